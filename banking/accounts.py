@@ -0,0 +1,25 @@
+from rest_framework import exceptions
+
+from django.db import models
+
+from . import checksums
+from .models import Account
+
+def request_account(request):
+	'''
+	The requesting user's Account, None for anonymous requests. It is cached on request.user, so it is loaded at most
+	once per request, and not at all when CachedTokenAuthentication already joined it into the user query.
+	'''
+	if not request.user.is_authenticated:
+		return None
+	try:
+		return request.user.account
+	except Account.DoesNotExist:
+		raise exceptions.PermissionDenied('errors.no_account')
+
+def account_for_iban(iban):
+	'''Our account with the given (valid) IBAN, None when it belongs to another bank or to no account'''
+	if not iban.startswith(checksums.IBAN_PREFIX + checksums.NIB_PREFIX):
+		return None
+	# Accounts the backfill (manage.py backfill_account_numbers) hasn't reached yet are still found by id
+	return Account.objects.filter(models.Q(iban=iban) | models.Q(id=int(iban[12:23]), iban__isnull=True)).first()
@@ -5,9 +5,23 @@ from django.contrib import admin
 from . import models
 
 admin.site.register(models.Account)
+admin.site.register(models.AccountShard)
 admin.site.register(models.Address)
 admin.site.register(models.TelcoProvider)
 admin.site.register(models.Transfer)
-admin.site.register(models.Card)
+admin.site.register(models.BalanceSnapshot)
+admin.site.register(models.LedgerEntry)
+admin.site.register(models.Hold)
 admin.site.register(models.DirectDebit)
-admin.site.register(models.StandingOrder)
\ No newline at end of file
+admin.site.register(models.StandingOrder)
+
+@admin.register(models.Card)
+class CardAdmin(admin.ModelAdmin):
+	list_display = ['name', 'number', 'account', 'blocked']
+	list_filter = ['blocked']
+	actions = ['unblock']
+
+	@admin.action(description='Unblock selected cards')
+	def unblock(self, request, queryset):
+		for card in queryset:
+			card.unblock()
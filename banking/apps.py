@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class BankingConfig(AppConfig):
 	default_auto_field = 'django.db.models.BigAutoField'
 	name = 'banking'
+
+	def ready(self):
+		from . import signals # noqa: F401 Evicts cached responses on writes
+		from upbank import knox_auth # noqa: F401 Evicts deleted tokens from the token cache
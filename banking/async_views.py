@@ -0,0 +1,101 @@
+'''
+Async versions of the read-heavy endpoints, served under api/async/.
+
+Under ASGI they wait on the database without holding a thread, so a worker can keep many slow clients connected.
+Responses are serialized with the same serializers as the synchronous views.
+'''
+from asgiref.sync import sync_to_async
+from djangorestframework_camel_case.util import camelize
+from rest_framework import exceptions
+from rest_framework.utils.urls import replace_query_param
+
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from upbank.knox_auth import CachedTokenAuthentication
+
+from . import queries, serializers
+from .accounts import request_account
+from .models import Account, Card, TelcoProvider, Transfer
+from .views import TransferPagination
+
+def _api_view(view):
+	'''Only GET from an authenticated user, turns APIExceptions into error responses like DRF would'''
+	async def wrapper(request, *args, **kwargs):
+		if request.method != 'GET':
+			return HttpResponseNotAllowed(['GET'])
+		try:
+			authenticated = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+			if authenticated is None:
+				raise exceptions.NotAuthenticated()
+			request.user, request.auth = authenticated
+			account = await sync_to_async(request_account)(request) # Usually joined into the user already
+			return JsonResponse(camelize(await view(request, account, *args, **kwargs)), safe=False)
+		except exceptions.APIException as e:
+			detail = e.detail if isinstance(e.detail, (list, dict)) else {'detail' : e.detail}
+			return JsonResponse(camelize(detail), status=e.status_code, safe=False)
+	return wrapper
+
+def _page_size(page_size):
+	'''Page size as the synchronous transfers/ pagination takes it'''
+	try:
+		return max(1, min(int(page_size), TransferPagination.max_page_size))
+	except (TypeError, ValueError):
+		return TransferPagination.page_size
+
+@_api_view
+async def transfers(request, account):
+	'''
+	Same filters as transfers/ (minDate, maxDate, fromTo, type), newest first. Pages are keyed by the id of the
+	last transfer of the previous page (before), given by the next link.
+	'''
+	params = request.GET
+	page_size = _page_size(params.get('pageSize'))
+	result = Transfer.objects.all()
+	if params.get('minDate') is not None:
+		result = result.filter(date__gte=params['minDate'])
+	if params.get('maxDate') is not None:
+		result = result.filter(date__lte=params['maxDate'])
+	if params.get('fromTo') is not None:
+		result = queries.counterparty_filter(result, account, params['fromTo'])
+
+	before = params.get('before')
+	if before is not None:
+		try:
+			before = int(before)
+		except ValueError:
+			raise exceptions.ValidationError(f'Invalid before: {before}')
+	transfer_type = params.get('type')
+	if transfer_type is None:
+		result = Transfer.objects.filter(id__in=await queries.alatest_transfer_ids(result, account, page_size + 1, before))
+	elif transfer_type in ('EXPENSE', 'INCOME'):
+		result = result.filter(**{'sender' if transfer_type == 'EXPENSE' else 'receiver' : account})
+		if before is not None:
+			result = result.filter(id__lt=before)
+	else:
+		raise exceptions.ValidationError(f'Invalid transfer type: {transfer_type}')
+
+	page = [transfer async for transfer in result.order_by('-id')[:page_size + 1]]
+	next_link = None
+	if len(page) > page_size:
+		page = page[:page_size]
+		next_link = replace_query_param(request.build_absolute_uri(), 'before', page[-1].id)
+	return {
+		'next' : next_link,
+		'results' : serializers.TransferSerializer(page, many=True, context={'request' : request, 'account_id' : account.id}).data,
+	}
+
+@_api_view
+async def account_detail(request, account, pk):
+	try:
+		profile = await Account.objects.select_related('address').aget(pk=pk, id=account.id)
+	except Account.DoesNotExist:
+		raise exceptions.NotFound()
+	return serializers.AccountSerializer(profile).data
+
+@_api_view
+async def cards(request, account):
+	return serializers.CardSerializer([card async for card in Card.objects.filter(account=account)], many=True).data
+
+@_api_view
+async def telco_providers(request, account):
+	return serializers.TelcoProviderSerializer([provider async for provider in TelcoProvider.objects.all()], many=True).data
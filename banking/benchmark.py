@@ -0,0 +1,221 @@
+'''
+Load-testing harness used by `manage.py benchmark` and `manage.py benchmark_checksums`.
+
+seed() bulk-creates a synthetic bank, run() drives one scenario from several threads through the full Django
+stack (middleware, DRF, serializers and database) and measures throughput, latency and lock contention.
+time_checksums() compares banking.checksums with the validators_pt and luhn functions it replaced.
+'''
+import datetime
+import itertools
+import random
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from time import perf_counter
+
+import luhn
+from rest_framework.test import APIClient
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connections, transaction
+
+from . import checksums, provisioning, validators_pt
+from .functions import id_to_iban
+from .models import Account, Transfer
+
+User = apps.get_model(settings.AUTH_USER_MODEL)
+
+# Fragments of the database errors that mean a request gave up waiting for a lock
+LOCK_ERRORS = ('locked', 'deadlock', 'lock timeout', 'could not obtain lock', 'could not serialize')
+
+FIRST_NAMES = ['Ana', 'Joao', 'Maria', 'Pedro', 'Ines', 'Rui', 'Beatriz', 'Tiago', 'Sofia', 'Miguel']
+LAST_NAMES = ['Silva', 'Santos', 'Ferreira', 'Pereira', 'Oliveira', 'Costa', 'Rodrigues', 'Martins', 'Sousa', 'Fernandes']
+
+def seed(account_count, transfer_count, batch_size=5000, balance=10 ** 12):
+	'''Bulk-creates account_count users with accounts and transfer_count transfers between them, returns the account ids'''
+	password = make_password('benchmark') # Hashed once, hashing every user would take longer than the benchmark
+	account_ids = []
+	for start in range(0, account_count, batch_size):
+		with transaction.atomic():
+			users = User.objects.bulk_create([
+				User(username=f'bench{i}@upbank.pt', email=f'bench{i}@upbank.pt', password=password)
+				for i in range(start, min(start + batch_size, account_count))
+			])
+			accounts = Account.objects.bulk_create([
+				Account(user=user, full_name=f'{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}', balance=balance)
+				for user in users
+			])
+			provisioning.number_accounts(accounts)
+			account_ids += [account.id for account in accounts]
+
+	names = dict(Account.objects.filter(id__in=account_ids).values_list('id', 'full_name'))
+	now = datetime.datetime.now(datetime.timezone.utc)
+	for start in range(0, transfer_count, batch_size):
+		transfers = []
+		for _ in range(start, min(start + batch_size, transfer_count)):
+			sender_id, receiver_id = random.sample(account_ids, 2)
+			transfers.append(Transfer(
+				sender_id=sender_id,
+				receiver_id=receiver_id,
+				sender_name=names[sender_id],
+				receiver_name=names[receiver_id],
+				amount=random.randint(1, 10000),
+				metadata={'type' : 'BENCHMARK'}
+			))
+		Transfer.objects.bulk_create(transfers)
+		# auto_now_add can't be overridden in bulk_create, spread the history over the last year afterwards
+		for transfer in transfers:
+			transfer.date = now - datetime.timedelta(minutes=random.randint(0, 525600))
+		Transfer.objects.bulk_update(transfers, ['date'])
+	return account_ids
+
+_signups = itertools.count()
+
+def _transfer_create(client, account_ids):
+	return client.post('/api/transfers/', {'receiver' : random.choice(account_ids), 'amount' : 1}, format='json', secure=True)
+
+def _transfer_list(client, account_ids):
+	params = random.choice([
+		{},
+		{'type' : random.choice(['EXPENSE', 'INCOME'])},
+		{'minDate' : (datetime.date.today() - datetime.timedelta(days=30)).isoformat()},
+		{'fromTo' : random.choice(LAST_NAMES)},
+	])
+	return client.get('/api/transfers/', params, secure=True)
+
+def _bank_transfer(client, account_ids):
+	return client.post('/api/bank-transfers/', {'iban' : id_to_iban(random.choice(account_ids)), 'amount' : 1}, format='json', secure=True)
+
+def _signup(client, account_ids):
+	email = f'signup{next(_signups)}-{random.getrandbits(32)}@upbank.pt'
+	return client.post('/api/accounts/', {
+		'email' : email,
+		'password' : 'benchmark-password',
+		'fullName' : f'{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}',
+		'birthdate' : '1990-01-01',
+		'address' : {'lineOne' : 'Rua Augusta 1', 'postalCode' : '1100-048', 'city' : 'Lisboa', 'district' : 'Lisboa'},
+		'taxNumber' : '123456789',
+		'idNumber' : '12345678',
+	}, format='json', secure=True)
+
+# name : (request, needs an authenticated client, writes)
+SCENARIOS = {
+	'transfer-create' : (_transfer_create, True, True),
+	'transfer-list' : (_transfer_list, True, False),
+	'bank-transfer' : (_bank_transfer, True, True),
+	'signup' : (_signup, False, True),
+}
+
+@dataclass
+class Result:
+	scenario: str
+	elapsed: float = 0.0
+	latencies: list = field(default_factory=list)
+	errors: int = 0
+	lock_waits: int = 0
+	failure: str = None # First failed request that wasn't a lock wait
+
+	@property
+	def failed(self):
+		'''Failed requests other than lock waits, the timings of a scenario with any are meaningless'''
+		return self.errors - self.lock_waits
+
+	def percentile(self, fraction):
+		if not self.latencies:
+			return 0.0
+		latencies = sorted(self.latencies)
+		return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+	@property
+	def lock_rate(self):
+		return self.lock_waits / len(self.latencies) if self.latencies else 0.0
+
+	@property
+	def throughput(self):
+		return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+def run(scenario, account_ids, requests, threads, serialize_writes=False):
+	'''
+	Sends `requests` requests of the scenario from `threads` threads, each acting as a random seeded user.
+	With serialize_writes, requests of writing scenarios wait for each other (SQLite has a single writer and fails
+	upgrading concurrent transactions to write ones instead of waiting), so the latencies include that queue.
+	'''
+	request, authenticated, writes = SCENARIOS[scenario]
+	result = Result(scenario)
+	lock = threading.Lock()
+	write_lock = threading.Lock() if serialize_writes and writes else nullcontext()
+	remaining = iter(range(requests))
+	users = list(User.objects.filter(account__id__in=random.sample(account_ids, min(threads, len(account_ids)))).select_related('account'))
+
+	def worker(index):
+		client = APIClient()
+		counterparties = account_ids
+		if authenticated:
+			user = users[index % len(users)]
+			client.force_authenticate(user)
+			counterparties = [account_id for account_id in account_ids if account_id != user.account.id] # Paying yourself is rejected
+		try:
+			while True:
+				with lock:
+					if next(remaining, None) is None:
+						return
+				start = perf_counter()
+				locked = False
+				try:
+					with write_lock:
+						response = request(client, counterparties)
+					failure = f'{response.status_code} {response.content[:200]!r}' if response.status_code >= 400 else None
+				except Exception as e: # The test client re-raises what the view raised
+					failure = f'{type(e).__name__}: {e}'
+					locked = isinstance(e, DatabaseError) and any(fragment in str(e).lower() for fragment in LOCK_ERRORS)
+				latency = (perf_counter() - start) * 1000
+				with lock:
+					result.latencies.append(latency)
+					if failure is not None:
+						result.errors += 1
+						result.lock_waits += locked
+						if not locked and result.failure is None:
+							result.failure = failure
+		finally:
+			connections.close_all() # Threads own their connections, the test database can't be dropped while they are open
+
+	workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+	start = perf_counter()
+	for thread in workers:
+		thread.start()
+	for thread in workers:
+		thread.join()
+	result.elapsed = perf_counter() - start
+	return result
+
+def _legacy_iban(account_id):
+	nib = checksums.NIB_PREFIX + str(account_id).zfill(11)
+	return checksums.IBAN_PREFIX + nib + str(validators_pt.generateControlNIB(nib)).zfill(2)
+
+def _legacy_card_number(account_id):
+	return luhn.append(checksums.CARD_PREFIX + str(account_id).zfill(9))
+
+def time_checksums(count):
+	'''Returns [(operation, seconds with validators_pt and luhn, seconds with checksums)] for count numbers'''
+	ids = random.sample(range(10 ** 9), count)
+	ibans = checksums.ibans_for_ids(ids)
+	cards = checksums.card_numbers_for_ids(ids)
+	cases = [
+		('generate IBANs', lambda: [_legacy_iban(i) for i in ids], lambda: [checksums.iban_for_id(i) for i in ids]),
+		('generate IBANs (batch)', lambda: [_legacy_iban(i) for i in ids], lambda: checksums.ibans_for_ids(ids)),
+		('validate IBANs', lambda: [validators_pt.controlIBAN(iban) for iban in ibans], lambda: checksums.valid_ibans(ibans)),
+		('generate card numbers', lambda: [_legacy_card_number(i) for i in ids], lambda: [checksums.card_number_for_id(i) for i in ids]),
+		('generate card numbers (batch)', lambda: [_legacy_card_number(i) for i in ids], lambda: checksums.card_numbers_for_ids(ids)),
+		('validate card numbers', lambda: [luhn.verify(card) for card in cards], lambda: checksums.valid_card_numbers(cards)),
+	]
+	results = []
+	for name, legacy, current in cases:
+		timings = []
+		for function in (legacy, current):
+			start = perf_counter()
+			function()
+			timings.append(perf_counter() - start)
+		results.append((name, *timings))
+	return results
@@ -0,0 +1,67 @@
+'''
+In-process index of the card state needed to authorize a payment, by card number.
+
+Authorizations are answered from compact records instead of a query joining cards and accounts. Records are loaded on
+first use and evicted when the card is saved or deleted (see banking.signals); other processes only notice after
+CARD_INDEX_TTL seconds, which bounds how long a blocked card keeps working there.
+'''
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from django.conf import settings
+from django.db import models
+
+from . import checksums
+from .models import Card
+
+class CardRecord:
+	__slots__ = ('card_id', 'account_id', 'expiry_date', 'pin_code', 'cvv', 'online_payments', 'nfc_payments', 'failed_attempts', 'blocked', 'loaded_at')
+
+	def __init__(self, card_id, account_id, expiry_date, pin_code, cvv, online_payments, nfc_payments, failed_attempts, blocked):
+		self.card_id = card_id
+		self.account_id = account_id
+		self.expiry_date = expiry_date
+		self.pin_code = pin_code
+		self.cvv = cvv
+		self.online_payments = online_payments
+		self.nfc_payments = nfc_payments
+		self.failed_attempts = failed_attempts
+		self.blocked = blocked
+		self.loaded_at = monotonic()
+
+_lock = threading.Lock()
+_records = OrderedDict() # Least recently used first
+
+def lookup(number):
+	'''The CardRecord of the card number, None if there is no such card'''
+	with _lock:
+		record = _records.get(number)
+		if record is not None and monotonic() - record.loaded_at < settings.CARD_INDEX_TTL:
+			_records.move_to_end(number)
+			return record
+
+	if not (number.startswith(checksums.CARD_PREFIX) and checksums.valid_card_number(number)):
+		return None
+	# Cards the backfill (manage.py backfill_account_numbers) hasn't reached yet are still found by id
+	cards = Card.objects.filter(models.Q(number=number) | models.Q(id=int(number[len(checksums.CARD_PREFIX):-1]), number__isnull=True))
+	values = cards.values_list(
+		'id', 'account_id', 'expiry_date', 'pin_code', 'cvv', 'online_payments', 'nfc_payments', 'failed_attempts', 'blocked'
+	).first()
+	if values is None:
+		return None
+	record = CardRecord(*values)
+	with _lock:
+		_records[number] = record
+		_records.move_to_end(number)
+		while len(_records) > settings.CARD_INDEX_SIZE:
+			_records.popitem(last=False)
+	return record
+
+def evict(number):
+	with _lock:
+		_records.pop(number, None)
+
+def clear():
+	with _lock:
+		_records.clear()
@@ -0,0 +1,109 @@
+'''
+Check digits of our IBANs/NIBs (mod 97), tax numbers (NIF, mod 11) and card numbers (Luhn).
+
+Same results as banking.validators_pt and the luhn package for well-formed numbers, but computed with integer
+arithmetic and precomputed tables instead of a list of ints per number. Anything that isn't all digits is invalid
+(validators_pt skipped stray characters). The *_for_ids functions generate in bulk, vectorized with NumPy when it is
+installed.
+'''
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+IBAN_PREFIX = 'PT50'
+NIB_PREFIX = '00972890'
+CARD_PREFIX = '436339'
+
+NIB_LENGTH = 21
+NIF_LENGTH = 9
+NIF_FIRST_DIGITS = '125689'
+
+# The NIB weights (73, 17, 89, ... 3) are 10^k mod 97, so the weighted sum of the 19 digits is int(digits) * 100 mod 97
+_NIB_PREFIX_REMAINDER = int(NIB_PREFIX) * 10 ** 13 % 97
+_NIF_WEIGHTS = tuple(range(9, 1, -1))
+_DIGITS = {str(digit) : digit for digit in range(10)}
+_LUHN_DOUBLED = {str(digit) : sum(divmod(2 * digit, 10)) for digit in range(10)}
+_LUHN_DOUBLED_TABLE = tuple(sum(divmod(2 * digit, 10)) for digit in range(10))
+_IBAN_ID_DIGITS = 11
+_CARD_ID_DIGITS = 9
+
+def _check_ids(ids, digits):
+	'''Ids must fit the digits the number has room for, a longer one would make an overlong (or, truncated, colliding) number'''
+	if any(not 0 <= account_id < 10 ** digits for account_id in ids):
+		raise ValueError(f'Ids must be between 0 and {10 ** digits - 1}')
+
+def nib_check(digits):
+	'''Check digits of the first 19 digits of a NIB, as an int (2 to 98)'''
+	return 98 - int(digits) * 100 % 97
+
+def valid_nib(nib):
+	return len(nib) == NIB_LENGTH and nib.isdigit() and nib_check(nib[:-2]) == int(nib[-2:])
+
+def valid_iban(iban):
+	'''Raises ValueError for non portuguese IBANs, like validators_pt.controlIBAN'''
+	if iban[:4] != IBAN_PREFIX:
+		raise ValueError(f'Unsupported IBAN: {iban[:4]}')
+	return valid_nib(iban[4:])
+
+def valid_nif(nif):
+	if len(nif) != NIF_LENGTH or not nif.isdigit() or nif[0] not in NIF_FIRST_DIGITS:
+		return False
+	remainder = sum(weight * _DIGITS[digit] for weight, digit in zip(_NIF_WEIGHTS, nif)) % 11
+	return (remainder and (11 - remainder) % 10) == _DIGITS[nif[-1]]
+
+def luhn_check(digits):
+	'''Luhn check digit to append to digits'''
+	total = 0
+	for position, digit in enumerate(reversed(digits)):
+		total += _LUHN_DOUBLED[digit] if position % 2 == 0 else _DIGITS[digit]
+	return -total % 10
+
+def valid_card_number(number):
+	return len(number) > 1 and number.isdigit() and luhn_check(number[:-1]) == _DIGITS[number[-1]]
+
+def iban_for_id(account_id):
+	_check_ids((account_id,), _IBAN_ID_DIGITS)
+	return f'{IBAN_PREFIX}{NIB_PREFIX}{account_id:011d}{98 - (_NIB_PREFIX_REMAINDER + account_id * 100) % 97:02d}'
+
+# Luhn sum of the card prefix, whose digits come right after the 9 id digits (counting from the right)
+_CARD_PREFIX_SUM = sum(
+	_LUHN_DOUBLED[digit] if (position + _CARD_ID_DIGITS) % 2 == 0 else _DIGITS[digit]
+	for position, digit in enumerate(reversed(CARD_PREFIX))
+)
+
+def card_number_for_id(account_id):
+	_check_ids((account_id,), _CARD_ID_DIGITS)
+	digits = f'{account_id:09d}'
+	total = _CARD_PREFIX_SUM
+	for position, digit in enumerate(reversed(digits)):
+		total += _LUHN_DOUBLED[digit] if position % 2 == 0 else _DIGITS[digit]
+	return f'{CARD_PREFIX}{digits}{-total % 10}'
+
+def ibans_for_ids(ids):
+	'''iban_for_id for a sequence of ids'''
+	_check_ids(ids, _IBAN_ID_DIGITS)
+	if numpy is None:
+		return [iban_for_id(account_id) for account_id in ids]
+	checks = 98 - (_NIB_PREFIX_REMAINDER + numpy.asarray(ids, dtype=numpy.int64) % 97 * 100) % 97
+	return [f'{IBAN_PREFIX}{NIB_PREFIX}{account_id:011d}{check:02d}' for account_id, check in zip(ids, checks.tolist())]
+
+def card_numbers_for_ids(ids):
+	'''card_number_for_id for a sequence of ids'''
+	_check_ids(ids, _CARD_ID_DIGITS)
+	if numpy is None:
+		return [card_number_for_id(account_id) for account_id in ids]
+	remaining = numpy.asarray(ids, dtype=numpy.int64)
+	doubled = numpy.array(_LUHN_DOUBLED_TABLE)
+	totals = numpy.full(len(remaining), _CARD_PREFIX_SUM, dtype=numpy.int64)
+	for position in range(_CARD_ID_DIGITS):
+		remaining, digits = numpy.divmod(remaining, 10)
+		totals += doubled[digits] if position % 2 == 0 else digits
+	return [f'{CARD_PREFIX}{account_id:09d}{check}' for account_id, check in zip(ids, (-totals % 10).tolist())]
+
+def valid_ibans(ibans):
+	'''[valid_iban(iban)] for a sequence of IBANs, non portuguese ones are invalid instead of raising'''
+	return [iban[:4] == IBAN_PREFIX and valid_nib(iban[4:]) for iban in ibans]
+
+def valid_card_numbers(numbers):
+	return [valid_card_number(number) for number in numbers]
@@ -0,0 +1,101 @@
+'''
+Holds reserve part of an account's balance (card authorizations) without moving any funds: an active hold is counted
+in Account.reserved, which every balance check already subtracts (Account.available).
+
+Placing a hold is a single conditional UPDATE. capture() turns it into a transfer, release() gives the funds back, and
+expire() sweeps the holds nobody captured or released before their expiry, in bulk.
+'''
+from collections import defaultdict
+
+from rest_framework import exceptions
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import ledger, shards, snapshots, system_accounts
+from .models import Account, Hold, Transfer
+
+def place(account_id, amount, card_id=None, merchant='', terminal='', expires_at=None):
+	'''Reserve amount on the account with a single conditional UPDATE, returns the hold'''
+	with transaction.atomic():
+		reserved = Account.objects.filter(id=account_id, balance__gte=models.F('reserved') + amount).update(reserved=models.F('reserved') + amount)
+		if not reserved:
+			raise exceptions.ValidationError('errors.insufficient_balance')
+		fields = {'expires_at' : expires_at} if expires_at is not None else {}
+		return Hold.objects.create(account_id=account_id, card_id=card_id, amount=amount, merchant=merchant, terminal=terminal, **fields)
+
+def _close(hold_id, terminal, status):
+	'''
+	Move an active, unexpired hold placed by the terminal to status and return it, only one concurrent capture or
+	release can win. Other terminals' holds are not found.
+	'''
+	hold = Hold.objects.filter(id=hold_id, terminal=terminal).first()
+	if hold is None:
+		raise exceptions.NotFound()
+	closed = Hold.objects.filter(id=hold_id, status=Hold.Status.ACTIVE, expires_at__gt=timezone.now()).update(status=status)
+	if not closed:
+		raise exceptions.ValidationError('errors.hold_not_active')
+	hold.status = status
+	return hold
+
+def release(hold_id, terminal):
+	'''Give the held funds back, returns the hold'''
+	with transaction.atomic():
+		hold = _close(hold_id, terminal, Hold.Status.RELEASED)
+		Account.objects.filter(id=hold.account_id).update(reserved=models.F('reserved') - hold.amount)
+		return hold
+
+def capture(hold_id, terminal, amount=None):
+	'''
+	Settle the hold (or part of it, the rest is released) as a card payment to the bank transfer account, which pays
+	the merchant's bank. Returns the hold, with its transfer.
+	'''
+	with transaction.atomic():
+		hold = _close(hold_id, terminal, Hold.Status.CAPTURED)
+		amount = hold.amount if amount is None else amount
+		if amount > hold.amount:
+			raise exceptions.ValidationError('errors.capture_exceeds_hold')
+
+		sender = Account.objects.only('id', 'full_name').get(id=hold.account_id)
+		receiver = system_accounts.get_account(system_accounts.BANK_TRANSFER)
+		metadata = {'type' : 'CARD_PAYMENT', 'merchant' : hold.merchant}
+		if settings.LEDGER_MODE:
+			Account.objects.filter(id=sender.id).update(reserved=models.F('reserved') - hold.amount)
+			transfer = ledger.post_transfer(sender, receiver, amount, metadata=metadata)
+		else:
+			# The hold kept the funds reserved, the balance can't go below zero here
+			Account.objects.filter(id=sender.id).update(balance=models.F('balance') - amount, reserved=models.F('reserved') - hold.amount)
+			shards.credit(receiver.id, amount)
+			snapshots.record_accounts({sender.id, receiver.id} - shards.sharded_account_ids())
+			transfer = Transfer.objects.create(sender=sender, receiver=receiver, amount=amount, metadata=metadata)
+		Hold.objects.filter(id=hold.id).update(transfer=transfer)
+		hold.transfer = transfer
+		return hold
+
+def expire(now=None, batch_size=1000):
+	'''Release a batch of the active holds past their expiry, returns how many expired'''
+	now = now or timezone.now()
+	with transaction.atomic():
+		# Several sweepers can run side by side, each one skips the holds the others hold
+		holds = list(
+			Hold.objects.select_for_update(skip_locked=True)
+			.filter(status=Hold.Status.ACTIVE, expires_at__lte=now)
+			.order_by('expires_at')
+			.values_list('id', 'account_id', 'amount')[:batch_size]
+		)
+		if not holds:
+			return 0
+
+		held = defaultdict(int)
+		for _, account_id, amount in holds:
+			held[account_id] += amount
+		Account.objects.filter(id__in=held.keys()).update(
+			reserved=models.F('reserved') - models.Case(
+				*[models.When(id=account_id, then=models.Value(amount)) for account_id, amount in held.items()],
+				default=models.Value(0),
+				output_field=models.BigIntegerField()
+			)
+		)
+		Hold.objects.filter(id__in=[hold_id for hold_id, _, _ in holds]).update(status=Hold.Status.EXPIRED)
+		return len(holds)
@@ -0,0 +1,57 @@
+import hashlib
+import json
+
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+
+from django.conf import settings
+from django.core.cache import caches
+
+class RequestInProgress(exceptions.APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = 'errors.request_in_progress'
+	default_code = 'request_in_progress'
+
+class IdempotencyKeyReused(exceptions.APIException):
+	status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+	default_detail = 'errors.idempotency_key_reused'
+	default_code = 'idempotency_key_reused'
+
+def _hash(value):
+	return hashlib.sha256(value.encode()).hexdigest()
+
+class IdempotentCreateMixin:
+	'''
+	Honours the Idempotency-Key header on create: the first successful response is kept in the "idempotency" cache
+	(bounded and expiring, see settings.CACHES) and replayed to retries with the same key, without running the create again.
+	While the first request runs the key is only leased for IDEMPOTENCY_LEASE seconds, in case its worker dies.
+	'''
+	def create(self, request, *args, **kwargs):
+		key = request.headers.get('Idempotency-Key')
+		if not key:
+			return super().create(request, *args, **kwargs)
+
+		cache = caches['idempotency']
+		cache_key = 'idempotency:' + _hash(f'{request.user.pk}:{request.path}:{key}')
+		fingerprint = _hash(json.dumps(request.data, sort_keys=True, default=str))
+
+		# add() is atomic, only one of several concurrent retries gets to run the create
+		while not cache.add(cache_key, {'fingerprint' : fingerprint, 'status' : None}, timeout=settings.IDEMPOTENCY_LEASE):
+			stored = cache.get(cache_key)
+			if stored is None:
+				continue # Expired in the meantime, try to claim it again
+			if stored['fingerprint'] != fingerprint:
+				raise IdempotencyKeyReused()
+			if stored['status'] is None:
+				raise RequestInProgress()
+			response = Response(stored['data'], status=stored['status'])
+			response['Idempotent-Replayed'] = 'true'
+			return response
+
+		try:
+			response = super().create(request, *args, **kwargs)
+		except Exception:
+			cache.delete(cache_key) # Failed requests can be retried with the same key
+			raise
+		cache.set(cache_key, {'fingerprint' : fingerprint, 'status' : response.status_code, 'data' : response.data})
+		return response
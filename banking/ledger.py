@@ -0,0 +1,86 @@
+'''
+Ledger mode (settings.LEDGER_MODE): transfers only append a debit and a credit LedgerEntry after reserving the
+funds on the sender with a single conditional UPDATE, and materialize() later folds the entries into Account.balance
+in batches. Funds received this way become available once materialized.
+'''
+from collections import defaultdict
+
+from rest_framework import exceptions
+
+from django.db import models, transaction
+
+from . import snapshots
+from .models import Account, Hold, LedgerEntry, Transfer
+
+def post_transfer(sender, receiver, amount, **fields):
+	'''Append a transfer and its ledger entries, returns the transfer'''
+	with transaction.atomic():
+		reserved = Account.objects.filter(id=sender.id, balance__gte=models.F('reserved') + amount).update(reserved=models.F('reserved') + amount)
+		if not reserved:
+			raise exceptions.ValidationError('errors.insufficient_balance')
+		transfer = Transfer.objects.create(sender=sender, receiver=receiver, amount=amount, **fields)
+		LedgerEntry.objects.bulk_create([
+			LedgerEntry(account_id=sender.id, transfer=transfer, amount=-amount),
+			LedgerEntry(account_id=receiver.id, transfer=transfer, amount=amount),
+		])
+		return transfer
+
+def materialize(batch_size=1000):
+	'''Fold a batch of pending entries into the balances, returns how many entries were folded'''
+	with transaction.atomic():
+		# Several materializers can run side by side, each one skips the entries the others hold
+		entries = list(
+			LedgerEntry.objects.select_for_update(skip_locked=True)
+			.filter(materialized=False)
+			.order_by('id')
+			.values_list('id', 'account_id', 'amount')[:batch_size]
+		)
+		if not entries:
+			return 0
+
+		balances = defaultdict(int)
+		debits = defaultdict(int)
+		for _, account_id, amount in entries:
+			balances[account_id] += amount
+			if amount < 0:
+				debits[account_id] -= amount
+
+		# Debits were reserved when they were posted, so the balance can't go below zero here
+		Account.objects.filter(id__in=balances.keys()).update(
+			balance=models.F('balance') + models.Case(
+				*[models.When(id=account_id, then=models.Value(delta)) for account_id, delta in balances.items()],
+				default=models.Value(0),
+				output_field=models.BigIntegerField()
+			),
+			reserved=models.F('reserved') - models.Case(
+				*[models.When(id=account_id, then=models.Value(debit)) for account_id, debit in debits.items()],
+				default=models.Value(0),
+				output_field=models.BigIntegerField()
+			)
+		)
+		LedgerEntry.objects.filter(id__in=[entry_id for entry_id, _, _ in entries]).update(materialized=True)
+		snapshots.record_accounts(balances.keys())
+		return len(entries)
+
+def unbalanced_transfers():
+	'''Transfers whose entries don't come as one debit and one credit of the same amount'''
+	return (
+		LedgerEntry.objects.values('transfer_id')
+		.annotate(total=models.Sum('amount'), entries=models.Count('id'))
+		.exclude(total=0, entries=2)
+	)
+
+def reservation_drift():
+	'''{account_id : (reserved, expected)} for every account whose reserved funds don't match its pending debits plus its active holds'''
+	expected = defaultdict(int)
+	pending = LedgerEntry.objects.filter(materialized=False, amount__lt=0).values('account_id').annotate(total=-models.Sum('amount'))
+	held = Hold.objects.filter(status=Hold.Status.ACTIVE).values('account_id').annotate(total=models.Sum('amount'))
+	for totals in (pending, held):
+		for account_id, total in totals.values_list('account_id', 'total'):
+			expected[account_id] += total
+	reserved = dict(Account.objects.filter(models.Q(reserved__gt=0) | models.Q(id__in=expected.keys())).values_list('id', 'reserved'))
+	return {
+		account_id : (reserved.get(account_id, 0), expected.get(account_id, 0))
+		for account_id in reserved.keys() | expected.keys()
+		if reserved.get(account_id, 0) != expected.get(account_id, 0)
+	}
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from banking import provisioning
+
+class Command(BaseCommand):
+	help = 'Stores the IBAN of every account and the number of every card created before they were stored'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows updated per query')
+
+	def handle(self, *args, **options):
+		accounts, cards = provisioning.backfill_numbers(chunk_size=options['chunk_size'])
+		self.stdout.write(self.style.SUCCESS(f'Numbered {accounts} accounts and {cards} cards'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from banking import snapshots
+
+class Command(BaseCommand):
+	help = 'Rebuilds the daily balance snapshots from the full transfer history'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=2000, help='Number of transfers fetched and snapshots written at a time')
+
+	def handle(self, *args, **options):
+		written, negative = snapshots.backfill(chunk_size=options['chunk_size'])
+		for account_id, date, balance in negative:
+			self.stdout.write(f'Account {account_id}: balance {balance} on {date}, not snapshotted')
+		if negative:
+			raise CommandError(f'Wrote {written} balance snapshots, {len(negative)} would be negative (run reconcile_balances)')
+		self.stdout.write(self.style.SUCCESS(f'Wrote {written} balance snapshots'))
@@ -0,0 +1,56 @@
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from banking import benchmark
+
+class Command(BaseCommand):
+	help = 'Seeds a throwaway database and load-tests the payment and history endpoints'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--accounts', type=int, default=1000, help='Number of seeded accounts')
+		parser.add_argument('--transfers', type=int, default=100000, help='Number of seeded transfers')
+		parser.add_argument('--requests', type=int, default=500, help='Number of requests sent per scenario')
+		parser.add_argument('--threads', type=int, default=8, help='Number of concurrent clients')
+		parser.add_argument('--max-lock-rate', type=float, default=0.01, help='Fraction of requests that may fail waiting for a lock before the run fails')
+		parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS.keys(), help='Scenario to run, can be repeated (default: all)')
+
+	def handle(self, *args, **options):
+		if options['accounts'] < 2:
+			raise CommandError('At least 2 accounts are needed to transfer between them')
+
+		setup_test_environment()
+		logging.getLogger('django.request').setLevel(logging.CRITICAL) # Failed requests are counted, not logged
+		if connection.vendor == 'sqlite':
+			# The default in-memory test database can't be shared between threads, use a file instead
+			connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+		old_name = connection.settings_dict['NAME']
+		connection.creation.create_test_db(verbosity=0, autoclobber=True)
+		try:
+			self.stdout.write(f'Seeding {options["accounts"]} accounts and {options["transfers"]} transfers...')
+			account_ids = benchmark.seed(options['accounts'], options['transfers'])
+
+			serialize_writes = connection.vendor == 'sqlite'
+			if serialize_writes:
+				self.stdout.write('SQLite has a single writer, requests of writing scenarios are sent one at a time')
+			failed = []
+			self.stdout.write(f'{"scenario":<16}{"requests":>10}{"errors":>8}{"locks":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+			for scenario in options['scenario'] or benchmark.SCENARIOS:
+				result = benchmark.run(scenario, account_ids, options['requests'], options['threads'], serialize_writes)
+				self.stdout.write(
+					f'{scenario:<16}{len(result.latencies):>10}{result.errors:>8}{result.lock_waits:>8}'
+					f'{result.throughput:>10.1f}{result.percentile(0.5):>10.1f}{result.percentile(0.99):>10.1f}'
+				)
+				if result.failed:
+					failed.append(f'{scenario}: {result.failed} requests failed, the first with {result.failure}')
+				if result.lock_rate > options['max_lock_rate']:
+					failed.append(f'{scenario}: {result.lock_waits} requests failed waiting for a lock, more than --max-lock-rate allows')
+			if failed:
+				raise CommandError('\n'.join(failed))
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0)
+			teardown_test_environment()
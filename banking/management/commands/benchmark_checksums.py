@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from banking import benchmark, checksums
+
+class Command(BaseCommand):
+	help = 'Times the IBAN and card number checksums against the validators_pt and luhn functions they replaced'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--count', type=int, default=100000, help='Numbers generated and validated per operation')
+
+	def handle(self, *args, **options):
+		self.stdout.write(f'NumPy batches: {"yes" if checksums.numpy is not None else "no (not installed)"}')
+		self.stdout.write(f'{"operation":<32}{"legacy ms":>12}{"checksums ms":>14}{"speedup":>10}')
+		for name, legacy, current in benchmark.time_checksums(options['count']):
+			self.stdout.write(f'{name:<32}{legacy * 1000:>12.1f}{current * 1000:>14.1f}{legacy / current:>9.1f}x')
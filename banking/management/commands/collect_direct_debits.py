@@ -0,0 +1,28 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from banking.settlement import collect_direct_debits
+
+class Command(BaseCommand):
+	help = 'Collects a batch file of "direct debit id,amount" rows, writing rows that could not be collected to a rejection report'
+
+	def add_arguments(self, parser):
+		parser.add_argument('batch_file', help='CSV file with one "direct debit id,amount" row per line')
+		parser.add_argument('--rejections', default='rejections.csv', help='Where to write the rejection report')
+		parser.add_argument('--chunk-size', type=int, default=500, help='Number of rows settled per transaction')
+
+	def handle(self, *args, **options):
+		with open(options['batch_file'], newline='') as batch, open(options['rejections'], 'w', newline='') as report:
+			writer = csv.writer(report)
+			writer.writerow(['direct_debit', 'amount', 'reason'])
+			rejected = 0
+
+			def reject(row, reason):
+				nonlocal rejected
+				rejected += 1
+				writer.writerow([*row, reason])
+
+			rows = (row for row in csv.reader(batch) if row)
+			collected = collect_direct_debits(rows, reject, chunk_size=options['chunk_size'])
+		self.stdout.write(self.style.SUCCESS(f'Collected {collected} direct debits, {rejected} rejected (see {options["rejections"]})'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from banking import holds
+
+class Command(BaseCommand):
+	help = 'Releases the holds that were neither captured nor released before their expiry'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000, help='Number of holds expired per transaction')
+		parser.add_argument('--loop', action='store_true', help='Keep running, waiting --interval seconds whenever there is nothing to expire')
+		parser.add_argument('--interval', type=float, default=60.0)
+
+	def handle(self, *args, **options):
+		total = 0
+		while True:
+			expired = holds.expire(batch_size=options['batch_size'])
+			total += expired
+			if expired:
+				continue
+			if not options['loop']:
+				break
+			time.sleep(options['interval'])
+		self.stdout.write(self.style.SUCCESS(f'Expired {total} holds'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from banking import shards
+
+class Command(BaseCommand):
+	help = 'Moves the balance of every account shard back into its account'
+
+	def handle(self, *args, **options):
+		for account_id in sorted(shards.sharded_account_ids()):
+			folded = shards.fold(account_id)
+			self.stdout.write(f'Account {account_id}: folded {folded}')
+		self.stdout.write(self.style.SUCCESS('Folded all account shards'))
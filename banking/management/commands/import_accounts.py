@@ -0,0 +1,42 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from banking import provisioning, workers
+
+class Command(BaseCommand):
+	help = 'Imports a customer book, creating every account like a signup would, and writes the rows that could not be imported to a rejection report'
+
+	def add_arguments(self, parser):
+		parser.add_argument('customers_file', help=f'File with one customer per row, with the fields {", ".join(provisioning.COLUMNS)}')
+		parser.add_argument('--format', choices=provisioning.FORMATS, help='Defaults to the file extension')
+		parser.add_argument('--rejections', default='rejections.csv', help='Where to write the rejection report')
+		parser.add_argument('--chunk-size', type=int, default=1000, help='Number of accounts created per transaction')
+		parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes hashing passwords, 1 hashes in this process')
+
+	def handle(self, *args, **options):
+		file_format = options['format'] or ('ndjson' if options['customers_file'].endswith(('.ndjson', '.jsonl')) else 'csv')
+		with open(options['customers_file'], newline='') as customers, open(options['rejections'], 'w', newline='') as report:
+			writer = csv.writer(report)
+			writer.writerow(['row', 'email', 'reason'])
+			rejected = 0
+
+			def reject(line, row, reason):
+				nonlocal rejected
+				rejected += 1
+				writer.writerow([line, row.get('email') if isinstance(row, dict) else '', reason])
+
+			rows = provisioning.read_rows(customers, file_format)
+			if options['workers'] > 1:
+				connections.close_all() # Don't share this connection with the workers
+				with ProcessPoolExecutor(max_workers=options['workers'], initializer=workers.init_worker) as pool:
+					def hash_passwords(passwords):
+						return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // options['workers'])))
+					created = provisioning.import_accounts(rows, reject, hash_passwords, chunk_size=options['chunk_size'])
+			else:
+				created = provisioning.import_accounts(rows, reject, chunk_size=options['chunk_size'])
+		self.stdout.write(self.style.SUCCESS(f'Imported {created} accounts, {rejected} rejected (see {options["rejections"]})'))
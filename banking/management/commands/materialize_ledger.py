@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from banking import ledger
+
+class Command(BaseCommand):
+	help = 'Folds pending ledger entries into the account balances'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000, help='Number of entries folded per transaction')
+		parser.add_argument('--loop', action='store_true', help='Keep running, waiting --interval seconds whenever there is nothing to fold')
+		parser.add_argument('--interval', type=float, default=1.0)
+
+	def handle(self, *args, **options):
+		total = 0
+		while True:
+			folded = ledger.materialize(batch_size=options['batch_size'])
+			total += folded
+			if folded:
+				continue
+			if not options['loop']:
+				break
+			time.sleep(options['interval'])
+		self.stdout.write(self.style.SUCCESS(f'Materialized {total} ledger entries'))
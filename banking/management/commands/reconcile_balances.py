@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from banking import reconciliation, workers
+
+class Command(BaseCommand):
+	help = 'Checks that every account balance equals its incoming minus its outgoing transfers'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=10000, help='Number of account ids checked per grouped query')
+		parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes checking id ranges in parallel, 1 runs in this process')
+
+	def handle(self, *args, **options):
+		ranges = reconciliation.id_ranges(options['chunk_size'])
+		if options['workers'] > 1 and len(ranges) > 1:
+			connections.close_all() # Don't share this connection with the workers
+			with ProcessPoolExecutor(max_workers=options['workers'], initializer=workers.init_worker) as pool:
+				results = pool.map(reconciliation.check_range, ranges)
+				drift = [row for rows in results for row in rows]
+		else:
+			drift = [row for id_range in ranges for row in reconciliation.check_range(id_range)]
+
+		for account_id, balance, expected in sorted(drift):
+			self.stdout.write(f'Account {account_id}: balance {balance}, expected {expected} ({balance - expected:+})')
+		if drift:
+			raise CommandError(f'{len(drift)} accounts have drifted')
+		self.stdout.write(self.style.SUCCESS(f'Checked {len(ranges)} id ranges, every balance matches its transfers'))
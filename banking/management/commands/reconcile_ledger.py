@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from banking import ledger
+
+class Command(BaseCommand):
+	help = 'Checks that every ledger transfer balances and that reserved funds match the pending debits and holds'
+
+	def handle(self, *args, **options):
+		errors = 0
+		for transfer in ledger.unbalanced_transfers():
+			errors += 1
+			self.stdout.write(f'Transfer {transfer["transfer_id"]}: {transfer["entries"]} entries adding up to {transfer["total"]}')
+		for account_id, (reserved, expected) in sorted(ledger.reservation_drift().items()):
+			errors += 1
+			self.stdout.write(f'Account {account_id}: {reserved} reserved for {expected} in pending debits and holds')
+		if errors:
+			raise CommandError(f'Found {errors} ledger inconsistencies')
+		self.stdout.write(self.style.SUCCESS('Ledger is consistent'))
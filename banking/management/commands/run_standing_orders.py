@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from banking.settlement import run_standing_orders
+
+class Command(BaseCommand):
+	help = 'Settles every standing order that is due, in chunked bulk transactions'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=500, help='Number of orders settled per transaction')
+
+	def handle(self, *args, **options):
+		settled, failed = run_standing_orders(chunk_size=options['chunk_size'])
+		self.stdout.write(self.style.SUCCESS(f'Settled {settled} standing orders, {failed} failed due to insufficient balance'))
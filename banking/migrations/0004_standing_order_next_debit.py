@@ -0,0 +1,46 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:05
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_next_debit(apps, schema_editor):
+    '''
+    Existing orders are next debited one period after their last debit (anchored on the day they were created, like
+    banking.settlement.debit_step), or on the day they were created if they were never debited.
+    '''
+    StandingOrder = apps.get_model('banking', 'StandingOrder')
+    orders = list(StandingOrder.objects.select_related('last_debit'))
+    for order in orders:
+        if order.last_debit is None:
+            order.next_debit = order.created_at
+            continue
+        anchor = order.created_at
+        order.next_debit = order.last_debit.date + {
+            'DAILY': relativedelta(days=1),
+            'WEEKLY': relativedelta(weeks=1),
+            'MONTHLY': relativedelta(months=1, day=anchor.day),
+            'YEARLY': relativedelta(years=1, month=anchor.month, day=anchor.day),
+        }[order.frequency]
+    StandingOrder.objects.bulk_update(orders, ['next_debit'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0003_default_accounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingorder',
+            name='next_debit',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_next_debit, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='standingorder',
+            index=models.Index(fields=['next_debit'], name='standing_order_due_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+def rename_government_payment_account(apps, schema_editor):
+	'''0003_default_accounts created the account with a missing trailing underscore'''
+	Account = apps.get_model('banking', 'Account') # NOSONAR
+	Account.objects.filter(full_name='__GOVERNMENT_PAYMENT_').update(full_name='__GOVERNMENT_PAYMENT__')
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('banking', '0004_standing_order_next_debit'),
+	]
+
+	operations = [
+		migrations.RunPython(rename_government_payment_account, migrations.RunPython.noop),
+	]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0005_government_payment_account_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('balance', models.PositiveBigIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='banking.account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='accountshard',
+            constraint=models.UniqueConstraint(fields=('account', 'shard'), name='unique_account_shard'),
+        ),
+    ]
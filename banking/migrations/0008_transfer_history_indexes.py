@@ -0,0 +1,40 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0007_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['sender', '-id'], name='transfer_sender_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['receiver', '-id'], name='transfer_receiver_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['sender', 'date'], name='transfer_sender_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['receiver', 'date'], name='transfer_receiver_date_idx'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='receiver',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='income', to='banking.account'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='sender',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='expenses', to='banking.account'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0008_transfer_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='receiver_name',
+            field=models.CharField(blank=True, default='', max_length=80),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='sender_name',
+            field=models.CharField(blank=True, default='', max_length=80),
+        ),
+    ]
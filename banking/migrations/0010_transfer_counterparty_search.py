@@ -0,0 +1,75 @@
+from django.db import migrations, models
+
+
+POSTGRES_FORWARD = [
+	'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+	# Expressions match the UPPER(...::text) LIKE UPPER(...) that Django emits for icontains
+	'CREATE INDEX transfer_sender_name_trgm ON banking_transfer USING gin (UPPER(sender_name::text) gin_trgm_ops)',
+	'CREATE INDEX transfer_receiver_name_trgm ON banking_transfer USING gin (UPPER(receiver_name::text) gin_trgm_ops)',
+]
+
+POSTGRES_REVERSE = [
+	'DROP INDEX IF EXISTS transfer_sender_name_trgm',
+	'DROP INDEX IF EXISTS transfer_receiver_name_trgm',
+]
+
+SQLITE_FORWARD = [
+	# External content FTS5 table over the transfer names, kept in sync by triggers so bulk_create is covered too
+	"CREATE VIRTUAL TABLE banking_transfer_search USING fts5(sender_name, receiver_name, content='banking_transfer', content_rowid='id', tokenize='trigram')",
+	'''CREATE TRIGGER banking_transfer_search_insert AFTER INSERT ON banking_transfer BEGIN
+		INSERT INTO banking_transfer_search(rowid, sender_name, receiver_name) VALUES (new.id, new.sender_name, new.receiver_name);
+	END''',
+	'''CREATE TRIGGER banking_transfer_search_delete AFTER DELETE ON banking_transfer BEGIN
+		INSERT INTO banking_transfer_search(banking_transfer_search, rowid, sender_name, receiver_name) VALUES ('delete', old.id, old.sender_name, old.receiver_name);
+	END''',
+	'''CREATE TRIGGER banking_transfer_search_update AFTER UPDATE OF sender_name, receiver_name ON banking_transfer BEGIN
+		INSERT INTO banking_transfer_search(banking_transfer_search, rowid, sender_name, receiver_name) VALUES ('delete', old.id, old.sender_name, old.receiver_name);
+		INSERT INTO banking_transfer_search(rowid, sender_name, receiver_name) VALUES (new.id, new.sender_name, new.receiver_name);
+	END''',
+	"INSERT INTO banking_transfer_search(banking_transfer_search) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+	'DROP TRIGGER IF EXISTS banking_transfer_search_insert',
+	'DROP TRIGGER IF EXISTS banking_transfer_search_delete',
+	'DROP TRIGGER IF EXISTS banking_transfer_search_update',
+	'DROP TABLE IF EXISTS banking_transfer_search',
+]
+
+
+def _run(schema_editor, statements):
+	for statement in statements:
+		schema_editor.execute(statement)
+
+def backfill_names(apps, schema_editor):
+	Transfer = apps.get_model('banking', 'Transfer') # NOSONAR
+	Account = apps.get_model('banking', 'Account') # NOSONAR
+	Transfer.objects.update(
+		sender_name=models.Subquery(Account.objects.filter(id=models.OuterRef('sender_id')).values('full_name')[:1]),
+		receiver_name=models.Subquery(Account.objects.filter(id=models.OuterRef('receiver_id')).values('full_name')[:1]),
+	)
+
+def create_search_index(apps, schema_editor):
+	vendor = schema_editor.connection.vendor
+	if vendor == 'postgresql':
+		_run(schema_editor, POSTGRES_FORWARD)
+	elif vendor == 'sqlite':
+		_run(schema_editor, SQLITE_FORWARD)
+
+def drop_search_index(apps, schema_editor):
+	vendor = schema_editor.connection.vendor
+	if vendor == 'postgresql':
+		_run(schema_editor, POSTGRES_REVERSE)
+	elif vendor == 'sqlite':
+		_run(schema_editor, SQLITE_REVERSE)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('banking', '0009_transfer_counterparty_names'),
+	]
+
+	operations = [
+		migrations.RunPython(backfill_names, migrations.RunPython.noop),
+		migrations.RunPython(create_search_index, drop_search_index),
+	]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0011_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='iban',
+            field=models.CharField(blank=True, editable=False, max_length=25, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='number',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True, unique=True),
+        ),
+    ]
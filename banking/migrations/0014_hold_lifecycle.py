@@ -0,0 +1,34 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:28
+
+import banking.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0013_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hold',
+            name='expires_at',
+            field=models.DateTimeField(default=banking.models.hold_expiry),
+        ),
+        migrations.AddField(
+            model_name='hold',
+            name='status',
+            field=models.CharField(choices=[('ACTIVE', 'Active'), ('CAPTURED', 'Captured'), ('RELEASED', 'Released'), ('EXPIRED', 'Expired')], default='ACTIVE', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='hold',
+            name='transfer',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='hold', to='banking.transfer'),
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['expires_at'], name='hold_active_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0014_hold_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='blocked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='failed_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0015_card_failed_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hold',
+            name='terminal',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from . import checksums
 
 class Account(models.Model):
 	'''Validate that user is 18 years old or older'''
@@ -9,13 +12,36 @@ class Account(models.Model):
 	tax_number = models.CharField(max_length=80, blank=True, null=True) # Char to support foreign tax numbers when manually registring
 	id_number = models.CharField(max_length=80, blank=True, null=True) # Char to support foreign ID numbers when manually registring
 	balance = models.PositiveBigIntegerField(default=0)
+	reserved = models.PositiveBigIntegerField(default=0) # Part of the balance already promised to pending ledger entries and holds
 	user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
+	iban = models.CharField(max_length=25, unique=True, blank=True, null=True, editable=False) # Derived from the id, filled once the id is known
 
 	created_at = models.DateTimeField(auto_now_add=True)
 
 	def __str__(self):
 		return self.full_name
 
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		if self.iban is None:
+			self.iban = checksums.iban_for_id(self.id)
+			Account.objects.filter(id=self.id).update(iban=self.iban)
+
+	@property
+	def available(self):
+		return self.balance - self.reserved
+
+class AccountShard(models.Model):
+	'''Balance bucket of a high-volume account, credits are spread over several rows so payments don't queue behind a single row lock'''
+	account = models.ForeignKey(Account, related_name='shards', on_delete=models.CASCADE)
+	shard = models.PositiveSmallIntegerField()
+	balance = models.PositiveBigIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['account', 'shard'], name='unique_account_shard'),
+		]
+
 class Address(models.Model):
 	line_one = models.CharField(max_length=80)
 	line_two = models.CharField(max_length=80, blank=True, null=True)
@@ -38,17 +64,104 @@ class Card(models.Model):
 	online_payments = models.BooleanField(default=True)
 	nfc_payments = models.BooleanField(default=True)
 	account = models.ForeignKey(Account, on_delete=models.CASCADE)
+	number = models.CharField(max_length=16, unique=True, blank=True, null=True, editable=False) # Derived from the id, filled once the id is known
+	failed_attempts = models.PositiveSmallIntegerField(default=0) # Wrong PINs or card details in a row, see CARD_MAX_FAILED_ATTEMPTS
+	blocked = models.BooleanField(default=False)
 
 	def __str__(self):
 		return self.name
 
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		if self.number is None:
+			self.number = checksums.card_number_for_id(self.id)
+			Card.objects.filter(id=self.id).update(number=self.number)
+
+	def unblock(self):
+		'''Lets the card be used again after CARD_MAX_FAILED_ATTEMPTS, saving it also evicts it from the card index'''
+		self.blocked = False
+		self.failed_attempts = 0
+		self.save(update_fields=['blocked', 'failed_attempts'])
+
 class Transfer(models.Model):
 	date = models.DateTimeField(auto_now_add=True)
-	sender = models.ForeignKey(Account, related_name='expenses', on_delete=models.PROTECT)
-	receiver = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='income')
+	sender = models.ForeignKey(Account, related_name='expenses', on_delete=models.PROTECT, db_index=False) # Covered by the composite indexes below
+	receiver = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='income', db_index=False) # Covered by the composite indexes below
 	amount = models.PositiveBigIntegerField()
 	metadata = models.JSONField()
 	notes = models.CharField(max_length=255, blank=True, null=True)
+	# Names at the time of the transfer, so the history can be searched by counterparty without joining Account (see queries.counterparty_filter)
+	sender_name = models.CharField(max_length=80, blank=True, default='')
+	receiver_name = models.CharField(max_length=80, blank=True, default='')
+
+	class Meta:
+		indexes = [
+			# History pages walk these backwards by id, see queries.latest_transfer_ids
+			models.Index(fields=['sender', '-id'], name='transfer_sender_idx'),
+			models.Index(fields=['receiver', '-id'], name='transfer_receiver_idx'),
+			models.Index(fields=['sender', 'date'], name='transfer_sender_date_idx'),
+			models.Index(fields=['receiver', 'date'], name='transfer_receiver_date_idx'),
+		]
+
+	def save(self, *args, **kwargs):
+		if not self.sender_name:
+			self.sender_name = self.sender.full_name
+		if not self.receiver_name:
+			self.receiver_name = self.receiver.full_name
+		return super().save(*args, **kwargs)
+
+class BalanceSnapshot(models.Model):
+	'''Closing balance of an account on a given day, days without transfers have no snapshot'''
+	account = models.ForeignKey(Account, related_name='balance_snapshots', on_delete=models.CASCADE)
+	date = models.DateField()
+	balance = models.PositiveBigIntegerField()
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['account', 'date'], name='unique_balance_snapshot'),
+		]
+
+class LedgerEntry(models.Model):
+	'''Debit (negative) or credit (positive) side of a transfer made in ledger mode, folded into Account.balance by ledger.materialize'''
+	account = models.ForeignKey(Account, related_name='ledger_entries', on_delete=models.PROTECT)
+	transfer = models.ForeignKey(Transfer, related_name='ledger_entries', on_delete=models.PROTECT)
+	amount = models.BigIntegerField()
+	materialized = models.BooleanField(default=False)
+
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['id'], condition=models.Q(materialized=False), name='ledger_entry_pending_idx'),
+		]
+
+def hold_expiry():
+	return timezone.now() + settings.HOLD_TTL
+
+class Hold(models.Model):
+	'''Funds reserved on an account (counted in Account.reserved while active) until captured, released or expired, see banking.holds'''
+	class Status(models.TextChoices):
+		ACTIVE = 'ACTIVE'
+		CAPTURED = 'CAPTURED'
+		RELEASED = 'RELEASED'
+		EXPIRED = 'EXPIRED'
+
+	account = models.ForeignKey(Account, related_name='holds', on_delete=models.PROTECT)
+	card = models.ForeignKey(Card, related_name='holds', on_delete=models.SET_NULL, blank=True, null=True)
+	amount = models.PositiveBigIntegerField()
+	merchant = models.CharField(max_length=80, blank=True, default='')
+	terminal = models.CharField(max_length=64, blank=True, default='') # Digest of the key of the terminal that placed it, the only one that can close it
+	status = models.CharField(max_length=8, choices=Status.choices, default=Status.ACTIVE)
+	expires_at = models.DateTimeField(default=hold_expiry)
+	transfer = models.OneToOneField(Transfer, related_name='hold', on_delete=models.PROTECT, blank=True, null=True) # Set once captured
+
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		indexes = [
+			# Walked by holds.expire
+			models.Index(fields=['expires_at'], condition=models.Q(status='ACTIVE'), name='hold_active_expiry_idx'),
+		]
 
 class DirectDebit(models.Model):
 	active = models.BooleanField(default=True)
@@ -72,6 +185,12 @@ class StandingOrder(models.Model):
 	amount = models.PositiveBigIntegerField()
 	last_debit = models.ForeignKey(Transfer, on_delete=models.PROTECT, related_name='+', blank=True, null=True)
 	metadata = models.JSONField()
+	next_debit = models.DateTimeField(default=timezone.now) # The first debit happens on the day the order is created
 	
 	created_at = models.DateTimeField(auto_now_add=True)
-	updated_at = models.DateTimeField(auto_now=True)
\ No newline at end of file
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['next_debit'], name='standing_order_due_idx'),
+		]
\ No newline at end of file
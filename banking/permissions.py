@@ -1,5 +1,10 @@
+import hashlib
+import hmac
+
 from rest_framework import permissions
 
+from django.conf import settings
+
 class IsAuthenticatedOrCreating(permissions.BasePermission):
 	"""
 	The request is authenticated as a user, or is a postrequest.
@@ -8,4 +13,17 @@ class IsAuthenticatedOrCreating(permissions.BasePermission):
 	def has_permission(self, request, view):
 		if request.method == 'POST' and not request.user.is_authenticated:
 			return True
-		return request.user and request.user.is_authenticated
\ No newline at end of file
+		return request.user and request.user.is_authenticated
+
+class HasTerminalKey(permissions.BasePermission):
+	"""
+	The request comes from a card terminal, identified by one of settings.CARD_TERMINAL_KEYS in the Terminal-Key header.
+	"""
+
+	def has_permission(self, request, view):
+		key = request.headers.get('Terminal-Key', '')
+		return any(hmac.compare_digest(key, terminal_key) for terminal_key in settings.CARD_TERMINAL_KEYS) # Every key is compared, no timing hints
+
+def terminal_id(request):
+	'''Identifies the terminal of a request HasTerminalKey allowed, without storing its key'''
+	return hashlib.sha256(request.headers.get('Terminal-Key', '').encode()).hexdigest()
@@ -0,0 +1,181 @@
+'''
+Bulk onboarding of customer books migrated from other banks, used by `manage.py import_accounts`.
+
+Rows are validated with the same rules as the signup endpoint, then each chunk is written with one bulk insert per
+table instead of the handful of queries AccountSerializer.create runs per account.
+
+Also holds the helpers filling the stored IBANs and card numbers of rows created in bulk, which skips Model.save().
+'''
+import csv
+import datetime
+import json
+from itertools import islice
+from random import SystemRandom
+
+from dateutil.relativedelta import relativedelta
+from rest_framework import exceptions
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core import exceptions as django_exceptions
+from django.core.validators import validate_email
+from django.db import transaction
+
+from . import checksums, snapshots, system_accounts
+from .models import Account, Address, Card, DirectDebit, Transfer
+from .validators import clean_birthdate, clean_invalid_characters, clean_postalcode, clean_taxnumber
+
+User = apps.get_model(settings.AUTH_USER_MODEL)
+
+FORMATS = ('csv', 'ndjson')
+COLUMNS = ['email', 'password', 'full_name', 'birthdate', 'tax_number', 'id_number', 'line_one', 'line_two', 'postal_code', 'city', 'district']
+REQUIRED = set(COLUMNS) - {'line_two'}
+
+def read_rows(file, file_format):
+	'''Yields one dict per customer, with a header row for csv or one JSON object per line for ndjson'''
+	if file_format == 'csv':
+		yield from csv.DictReader(file)
+	else:
+		for line in file:
+			if line.strip():
+				try:
+					yield json.loads(line)
+				except json.JSONDecodeError:
+					yield {}
+
+def number_accounts(accounts):
+	'''Fills the IBAN of freshly bulk-created accounts'''
+	for account, iban in zip(accounts, checksums.ibans_for_ids([account.id for account in accounts])):
+		account.iban = iban
+	Account.objects.bulk_update(accounts, ['iban'])
+
+def create_cards(accounts):
+	'''Creates the cards every new account gets, numbered'''
+	cards = Card.objects.bulk_create([card for account in accounts for card in new_cards(account)])
+	for card, number in zip(cards, checksums.card_numbers_for_ids([card.id for card in cards])):
+		card.number = number
+	Card.objects.bulk_update(cards, ['number'])
+	return cards
+
+def backfill_numbers(chunk_size=2000):
+	'''Fills the IBANs and card numbers of the rows created before they were stored, returns (accounts, cards) updated'''
+	updated = []
+	for model, field, generate in ((Account, 'iban', checksums.ibans_for_ids), (Card, 'number', checksums.card_numbers_for_ids)):
+		total = 0
+		while ids := list(model.objects.filter(**{f'{field}__isnull' : True}).order_by('id').values_list('id', flat=True)[:chunk_size]):
+			rows = [model(id=row_id, **{field : value}) for row_id, value in zip(ids, generate(ids))]
+			model.objects.bulk_update(rows, [field])
+			total += len(rows)
+		updated.append(total)
+	return tuple(updated)
+
+def new_cards(account):
+	'''The physical and virtual cards every new account gets, unsaved'''
+	generator = SystemRandom()
+	expiry_date = datetime.datetime.now() + relativedelta(years=2)
+	return [
+		Card(account=account, name=name, expiry_date=expiry_date, pin_code=generator.randint(0, settings.MAX_PIN), cvv=generator.randint(0, settings.MAX_CVV))
+		for name in ('__PHYSICAL_CARD__', '__VIRTUAL_CARD__')
+	]
+
+def clean_row(row):
+	'''Returns the validated row, raises a ValidationError with the error code otherwise'''
+	if not isinstance(row, dict) or any(not row.get(column) for column in REQUIRED):
+		raise exceptions.ValidationError('errors.missing_fields')
+	row = {column : str(row[column]).strip() if row.get(column) else None for column in COLUMNS}
+	if any(len(row[column]) > 80 for column in COLUMNS if row[column] and column != 'password'):
+		raise exceptions.ValidationError('errors.field_too_long')
+
+	try:
+		validate_email(row['email'])
+	except django_exceptions.ValidationError as e:
+		raise exceptions.ValidationError('errors.invalid_email') from e
+	try:
+		validate_password(row['password'])
+	except django_exceptions.ValidationError as e:
+		raise exceptions.ValidationError('errors.invalid_password') from e
+	try:
+		row['birthdate'] = datetime.date.fromisoformat(row['birthdate'])
+	except ValueError as e:
+		raise exceptions.ValidationError('errors.invalid_birthdate') from e
+
+	clean_birthdate(row['birthdate'])
+	clean_invalid_characters(row['full_name'])
+	clean_taxnumber(row['tax_number'])
+	clean_postalcode(row['postal_code'])
+	return row
+
+def _provision(rows, password_hashes):
+	'''Creates the accounts of a chunk of validated rows, with the same welcome gift, cards and direct debit as a signup'''
+	upbank = system_accounts.get_account(system_accounts.UPBANK)
+	with transaction.atomic():
+		addresses = Address.objects.bulk_create([
+			Address(line_one=row['line_one'], line_two=row['line_two'], postal_code=row['postal_code'], city=row['city'], district=row['district'])
+			for row in rows
+		])
+		users = User.objects.bulk_create([
+			User(email=row['email'], username=row['email'], password=password_hash)
+			for row, password_hash in zip(rows, password_hashes)
+		])
+		accounts = Account.objects.bulk_create([
+			Account(
+				full_name=row['full_name'],
+				birthdate=row['birthdate'],
+				tax_number=row['tax_number'],
+				id_number=row['id_number'],
+				address=address,
+				user=user,
+				balance=settings.DEFAULT_BALANCE
+			)
+			for row, address, user in zip(rows, addresses, users)
+		])
+		number_accounts(accounts)
+		Transfer.objects.bulk_create([
+			Transfer(
+				sender=upbank,
+				receiver=account,
+				sender_name=upbank.full_name,
+				receiver_name=account.full_name,
+				amount=settings.DEFAULT_BALANCE,
+				metadata={'type' : 'WELCOMEGIFT'}
+			)
+			for account in accounts
+		])
+		snapshots.record({account.id : settings.DEFAULT_BALANCE for account in accounts})
+		create_cards(accounts)
+		DirectDebit.objects.bulk_create([DirectDebit(sender=account, receiver=upbank) for account in accounts])
+	return len(accounts)
+
+def _hash_passwords(passwords):
+	return [make_password(password) for password in passwords]
+
+def import_accounts(rows, reject, hash_passwords=_hash_passwords, chunk_size=1000):
+	'''
+	Validates and creates the accounts of the given rows chunk by chunk, calling reject(row number, row, reason) for the rows that
+	can't be imported. hash_passwords maps a list of passwords to their hashes (e.g. on a process pool). Returns the number
+	of created accounts.
+	'''
+	created = 0
+	rows = enumerate(rows, start=1)
+	while chunk := list(islice(rows, chunk_size)):
+		cleaned = []
+		for line, row in chunk:
+			try:
+				cleaned.append((line, clean_row(row)))
+			except exceptions.ValidationError as e:
+				reject(line, row, str(e.detail[0]))
+
+		# Emails are usernames, they must be unique within the chunk and against the existing users
+		taken = set(User.objects.filter(username__in=[row['email'] for _, row in cleaned]).values_list('username', flat=True))
+		valid = []
+		for line, row in cleaned:
+			if row['email'] in taken:
+				reject(line, row, 'errors.duplicate_email')
+			else:
+				taken.add(row['email'])
+				valid.append(row)
+		if valid:
+			created += _provision(valid, hash_passwords([row['password'] for row in valid]))
+	return created
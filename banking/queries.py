@@ -0,0 +1,58 @@
+from heapq import merge
+from itertools import islice
+
+from django.db import connection, models
+from django.db.models.expressions import RawSQL
+
+def _history_scans(queryset, account, limit, position, reverse):
+	'''The (sender, -id) and (receiver, -id) index scans behind latest_transfer_ids'''
+	ordering = 'id' if reverse else '-id'
+	if position is not None:
+		queryset = queryset.filter(**{'id__gt' if reverse else 'id__lt' : position})
+	sent = queryset.filter(sender=account).order_by(ordering).values_list('id', flat=True)[:limit]
+	received = queryset.filter(receiver=account).order_by(ordering).values_list('id', flat=True)[:limit]
+	return sent, received
+
+def latest_transfer_ids(queryset, account, limit, position=None, reverse=False):
+	'''
+	Given an already filtered transfer queryset, returns the ids of the latest `limit` transfers sent or received by the account
+	(after the `position` id, oldest first when `reverse`), as the UNION of a (sender, -id) and a (receiver, -id) index scan
+	that each stop after `limit` rows instead of OR-ing both sides and sorting every transfer of the account.
+	'''
+	sent, received = _history_scans(queryset, account, limit, position, reverse)
+	if connection.features.supports_slicing_ordering_in_compound:
+		return sent.union(received)
+	# SQLite can't LIMIT the branches of a compound query, run both scans and merge them instead
+	return list(islice(merge(sent, received, reverse=not reverse), limit))
+
+async def alatest_transfer_ids(queryset, account, limit, position=None):
+	'''latest_transfer_ids for async views, always newest first'''
+	sent, received = _history_scans(queryset, account, limit, position, False)
+	if connection.features.supports_slicing_ordering_in_compound:
+		return [transfer_id async for transfer_id in sent.union(received)]
+	sent = [transfer_id async for transfer_id in sent]
+	received = [transfer_id async for transfer_id in received]
+	return list(islice(merge(sent, received, reverse=True), limit))
+
+def _fts_matches(column, term):
+	'''Ids of the transfers whose column contains term, through the SQLite FTS5 trigram index'''
+	return RawSQL(
+		'SELECT rowid FROM banking_transfer_search WHERE banking_transfer_search MATCH %s',
+		['%s : "%s"' % (column, term.replace('"', '""'))]
+	)
+
+def counterparty_filter(queryset, account, term):
+	'''
+	Given a transfer queryset, keeps the transfers whose counterparty (the receiver of the account's expenses
+	and the sender of its income) contains term, case insensitive.
+	Postgres answers icontains from the trigram indexes, SQLite from the FTS5 trigram table, which needs at least 3 characters.
+	'''
+	if connection.vendor == 'sqlite' and len(term) >= 3:
+		return queryset.filter(
+			models.Q(sender=account, id__in=_fts_matches('receiver_name', term)) |
+			models.Q(receiver=account, id__in=_fts_matches('sender_name', term))
+		)
+	return queryset.filter(
+		models.Q(sender=account, receiver_name__icontains=term) |
+		models.Q(receiver=account, sender_name__icontains=term)
+	)
@@ -0,0 +1,40 @@
+from django.db import models
+
+from .models import Account, AccountShard, LedgerEntry, Transfer
+
+# Transfers without a type key must still count, a bare exclude(metadata__type=...) would drop them (NOT NULL is NULL)
+_welcome_gifts = models.Q(metadata__type='WELCOMEGIFT') & models.Q(metadata__type__isnull=False)
+
+def _totals(queryset, key, value):
+	return dict(queryset.order_by().values(key).annotate(total=models.Sum(value)).values_list(key, 'total'))
+
+def _in_range(field, first_id, last_id):
+	return {f'{field}__gte' : first_id, f'{field}__lte' : last_id} # Foreign keys don't support __range
+
+def account_drift(first_id, last_id):
+	'''
+	Returns [(account_id, balance, expected)] for every account in the id range whose balance (including unfolded shards and
+	pending ledger entries) doesn't equal its income minus its expenses. Welcome gifts are never debited from __UPBANK__.
+	'''
+	income = _totals(Transfer.objects.filter(**_in_range('receiver_id', first_id, last_id)), 'receiver_id', 'amount')
+	expenses = _totals(Transfer.objects.filter(**_in_range('sender_id', first_id, last_id)).exclude(_welcome_gifts), 'sender_id', 'amount')
+	unfolded = _totals(AccountShard.objects.filter(**_in_range('account_id', first_id, last_id)), 'account_id', 'balance')
+	pending = _totals(LedgerEntry.objects.filter(**_in_range('account_id', first_id, last_id), materialized=False), 'account_id', 'amount')
+
+	drift = []
+	for account_id, balance in Account.objects.filter(id__range=(first_id, last_id)).values_list('id', 'balance').iterator():
+		balance += unfolded.get(account_id, 0) + pending.get(account_id, 0)
+		expected = income.get(account_id, 0) - expenses.get(account_id, 0)
+		if balance != expected:
+			drift.append((account_id, balance, expected))
+	return drift
+
+def id_ranges(chunk_size):
+	'''Splits the account ids into (first, last) ranges of chunk_size ids'''
+	bounds = Account.objects.aggregate(first=models.Min('id'), last=models.Max('id'))
+	if bounds['first'] is None:
+		return []
+	return [(start, min(start + chunk_size - 1, bounds['last'])) for start in range(bounds['first'], bounds['last'] + 1, chunk_size)]
+
+def check_range(id_range):
+	return account_drift(*id_range)
@@ -0,0 +1,44 @@
+'''
+Serialized responses of rarely changing GETs, kept in the "responses" cache (see settings.CACHES) with their ETag.
+
+Entries are evicted by the model signals in banking.signals, so a cached response is never older than the last write
+through the ORM. Clients sending the ETag back in If-None-Match get an empty 304 when nothing changed.
+'''
+import hashlib
+import json
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from django.core.cache import caches
+
+TELCO_PROVIDERS = 'telco-providers'
+
+def account_key(account_id):
+	return f'account:{account_id}'
+
+def _etag(value):
+	return '"%s"' % hashlib.sha1(value.encode()).hexdigest()
+
+def get_or_set(key, serialize):
+	'''Returns (data, etag) for key, calling serialize() on a miss'''
+	cache = caches['responses']
+	entry = cache.get(key)
+	if entry is None:
+		data = serialize()
+		entry = (data, _etag(json.dumps(data, sort_keys=True, default=str)))
+		cache.set(key, entry)
+	return entry
+
+def evict(*keys):
+	caches['responses'].delete_many(keys)
+
+def respond(request, data, etag):
+	headers = {'ETag' : etag, 'Cache-Control' : 'private, no-cache'} # Clients may keep it, but must revalidate every time
+	if etag in (tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')):
+		return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+	return Response(data, headers=headers)
+
+def respond_with_balance(request, data, etag, balance):
+	'''The balance changes with every transfer (mostly through UPDATEs no signal sees), so it is merged in fresh'''
+	return respond(request, {**data, 'balance' : balance}, _etag(f'{etag}:{balance}'))
@@ -1,16 +1,20 @@
-import datetime
-from dateutil.relativedelta import relativedelta
-from random import SystemRandom
+import hmac
 
 from rest_framework import serializers, exceptions, validators
 
 from banking.functions import id_to_card_number, id_to_iban
-from .models import Account, Address, Card, DirectDebit, StandingOrder, Transfer, TelcoProvider
+from .models import Account, Address, BalanceSnapshot, Card, DirectDebit, Hold, StandingOrder, Transfer, TelcoProvider
+from .accounts import account_for_iban, request_account
+from .permissions import terminal_id
+from . import card_index, holds, ledger, provisioning, settlement, shards, snapshots, system_accounts
 
 from django.conf import settings
 from django.apps import apps
 from django.db import transaction, models
 from django.contrib.auth.password_validation import validate_password
+from django.utils import timezone
+
+from upbank import hashing
 
 from .validators import clean_postalcode, clean_taxnumber, clean_birthdate, clean_invalid_characters, clean_iban
 
@@ -43,25 +47,25 @@ class AccountSerializer(serializers.ModelSerializer):
 		fields = ['id', 'email', 'password', 'full_name', 'birthdate', 'address', 'tax_number', 'id_number', 'balance', 'iban', 'created_at']
 	
 	def get_iban(self, obj):
-		return id_to_iban(obj.id)
+		return obj.iban or id_to_iban(obj.id)
 	
 	def create(self, validated_data):
+		# Hashed before the transaction opens, the async signup hashes it itself and passes save(password_hash=...)
+		password = validated_data.pop('password')
+		password_hash = validated_data.pop('password_hash', None) or hashing.make_password(password)
 		with transaction.atomic():
 			address_data = validated_data.pop('address')
 			address = AddressSerializer().create(address_data)
 
 			email = validated_data.pop('email')
-			user = User.objects.create(email=email, username=email)
-			user.set_password(validated_data.pop('password'))
-			user.save()
+			user = User.objects.create(email=email, username=email, password=password_hash)
 
 			account = Account.objects.create(**validated_data, address=address, user=user, balance=settings.DEFAULT_BALANCE)
-			upbank = Account.objects.get(full_name='__UPBANK__')
+			upbank = system_accounts.get_account(system_accounts.UPBANK)
 			Transfer.objects.create(sender=upbank, receiver=account, amount=settings.DEFAULT_BALANCE, metadata={'type' : 'WELCOMEGIFT'})
+			snapshots.record({account.id : settings.DEFAULT_BALANCE})
 
-			generator = SystemRandom()
-			Card.objects.create(account=account, name="__PHYSICAL_CARD__", expiry_date=datetime.datetime.now() + relativedelta(years=2), pin_code=generator.randint(0, settings.MAX_PIN), cvv=generator.randint(0, settings.MAX_CVV))
-			Card.objects.create(account=account, name="__VIRTUAL_CARD__", expiry_date=datetime.datetime.now() + relativedelta(years=2), pin_code=generator.randint(0, settings.MAX_PIN), cvv=generator.randint(0, settings.MAX_CVV))
+			provisioning.create_cards([account])
 
 			DirectDebit.objects.create(sender=account, receiver=upbank)
 			return account
@@ -81,7 +85,7 @@ class TransferSerializer(serializers.Serializer):
 	
 	def get_name(self, obj):
 		'''If user is sender, get receiver, otherwise get sender'''
-		if obj.sender == self.context['request'].user.account:
+		if obj.sender == request_account(self.context['request']):
 			return obj.receiver.full_name
 		return obj.sender.full_name
 	
@@ -89,7 +93,7 @@ class TransferSerializer(serializers.Serializer):
 		with transaction.atomic():
 			if 'user' not in self.context['request']:
 				raise exceptions.AuthenticationFailed('errors.auth')
-			sender = Account.objects.select_for_update().get(user=self.context['request'].user) # Lock sender account to ensure no funny balance business occurs
+			sender = Account.objects.select_for_update().get(id=request_account(self.context['request']).id) # Lock sender account to ensure no funny balance business occurs
 			if sender.balance < validated_data['amount']:
 				raise exceptions.ValidationError('errors.insufficient_balance')
 			sender.balance = models.F('balance') - validated_data['amount']
@@ -113,32 +117,75 @@ class TransferSerializer(serializers.Serializer):
 		model = Transfer
 		fields = ['date', 'name', 'type', 'amount', 'metadata', 'notes', 'receiver']
 	
+	def _account_id(self):
+		'''Id of the requesting user's account, resolved once and shared by every row of a list'''
+		if 'account_id' not in self.context:
+			self.context['account_id'] = request_account(self.context['request']).id
+		return self.context['account_id']
+	
 	def get_name(self, obj):
 		'''If user is sender, get receiver, otherwise get sender'''
-		if obj.sender == self.context['request'].user.account:
-			return obj.receiver.full_name
-		return obj.sender.full_name
+		if obj.sender_id == self._account_id():
+			return obj.receiver_name
+		return obj.sender_name
 	
 	def get_type(self, obj):
-		if obj.sender == self.context['request'].user.account:
+		if obj.sender_id == self._account_id():
 			return 'EXPENSE'
 		return 'INCOME'
 	
 	def create(self, validated_data):
+		validated_data.setdefault('metadata', {'type' : 'INTERNAL'}) # Payment subclasses pass their own
+		if settings.LEDGER_MODE:
+			sender = request_account(self.context['request'])
+			if sender == validated_data['receiver']:
+				raise exceptions.ValidationError('errors.transfer_to_self')
+			return ledger.post_transfer(sender, validated_data.pop('receiver'), validated_data.pop('amount'), **validated_data)
+
 		with transaction.atomic():
-			sender = Account.objects.select_for_update().get(user=self.context['request'].user) # Lock sender account to ensure no funny balance business occurs
-			if sender.balance < validated_data['amount']:
+			sender = Account.objects.select_for_update().get(id=request_account(self.context['request']).id) # Lock sender account to ensure no funny balance business occurs
+			if sender.available < validated_data['amount']:
 				raise exceptions.ValidationError('errors.insufficient_balance')
 			if sender == validated_data['receiver']:
 				raise exceptions.ValidationError('errors.transfer_to_self')
 			sender.balance = models.F('balance') - validated_data['amount']
-			sender.save()
+			sender.save(update_fields=['balance'])
 			
 			receiver = validated_data.pop('receiver')
-			receiver.balance = models.F('balance') + validated_data['amount']
-			receiver.save()
+			shards.credit(receiver.id, validated_data['amount'])
+			snapshots.record_accounts({sender.id, receiver.id} - shards.sharded_account_ids())
 			return Transfer.objects.create(sender=sender, receiver=receiver, **validated_data)
 
+class BatchTransferItemSerializer(serializers.Serializer):
+	receiver = serializers.IntegerField(min_value=1)
+	amount = serializers.IntegerField(min_value=1)
+	notes = serializers.CharField(max_length=80, allow_blank=True, allow_null=True, required=False)
+
+class BatchTransferSerializer(serializers.Serializer):
+	transfers = BatchTransferItemSerializer(many=True, allow_empty=False, max_length=settings.MAX_BATCH_TRANSFERS)
+	atomic = serializers.BooleanField(default=True) # All-or-nothing, otherwise every valid item goes through
+
+	def validate_transfers(self, transfers):
+		receivers = {transfer['receiver'] for transfer in transfers}
+		if Account.objects.filter(id__in=receivers).count() != len(receivers):
+			raise exceptions.ValidationError('errors.invalid_receiver')
+		return transfers
+
+	def create(self, validated_data):
+		sender = request_account(self.context['request'])
+		return {
+			'atomic' : validated_data['atomic'],
+			'results' : settlement.settle_batch(sender.id, validated_data['transfers'], validated_data['atomic'])
+		}
+
+	def to_representation(self, instance):
+		return instance
+
+class BalanceSnapshotSerializer(serializers.ModelSerializer):
+	class Meta:
+		model = BalanceSnapshot
+		fields = ['date', 'balance']
+
 class BankTransferSerializer(TransferSerializer):
 	iban = serializers.CharField(min_length=25, max_length=25, write_only=True, validators=[clean_iban])
 
@@ -150,10 +197,7 @@ class BankTransferSerializer(TransferSerializer):
 	
 	def create(self, validated_data):
 		iban = validated_data.pop('iban')
-		try:
-			receiver = Account.objects.get(id=int(iban[12:23]))
-		except Account.DoesNotExist:
-			receiver = Account.objects.get(full_name='__BANK_TRANSFER__')
+		receiver = account_for_iban(iban) or system_accounts.get_account(system_accounts.BANK_TRANSFER)
 		return super().create({'receiver' : receiver, 'metadata' : {'type' : 'NATIONAL', 'iban' : iban}, **validated_data})
 
 class ServicePaymentSerializer(TransferSerializer):
@@ -170,7 +214,7 @@ class ServicePaymentSerializer(TransferSerializer):
 	def create(self, validated_data):
 		entity = validated_data.pop('entity')
 		reference = validated_data.pop('reference')
-		receiver = Account.objects.get(full_name='__SERVICE_PAYMENT__')
+		receiver = system_accounts.get_account(system_accounts.SERVICE_PAYMENT)
 		return super().create({'receiver' : receiver, 'metadata' : {'type' : 'SERVICE', 'entity' : entity, 'reference' : reference}, **validated_data})
 
 class GovernmentPaymentSerializer(TransferSerializer):
@@ -185,7 +229,7 @@ class GovernmentPaymentSerializer(TransferSerializer):
 	
 	def create(self, validated_data):
 		reference = validated_data.pop('reference')
-		receiver = Account.objects.get(full_name='__GOVERNMENT_PAYMENT__')
+		receiver = system_accounts.get_account(system_accounts.GOVERNMENT_PAYMENT)
 		return super().create({'receiver' : receiver, 'metadata' : {'type' : 'GOVERNMENT', 'reference' : reference}, **validated_data})
 
 class TelcoPaymentSerializer(TransferSerializer):
@@ -214,7 +258,7 @@ class TelcoProviderSerializer(serializers.ModelSerializer):
 		fields = ['id', 'name']
 
 class StandingOrderSerializer(serializers.ModelSerializer):
-	iban = serializers.CharField(min_length=25, max_length=25, write_only=True)
+	iban = serializers.CharField(min_length=25, max_length=25, write_only=True, validators=[clean_iban])
 	name = serializers.CharField(source='receiver.full_name', read_only=True)
 	amount = serializers.IntegerField(min_value=1)
 	
@@ -224,15 +268,12 @@ class StandingOrderSerializer(serializers.ModelSerializer):
 	
 	def create(self, validated_data):
 		iban = validated_data.pop('iban')
-		sender = self.context['request'].user.account
+		sender = request_account(self.context['request'])
 		if sender.standing_orders.count() >= 20:
 			raise exceptions.ValidationError('errors.too_many_standing_orders')
-		try:
-			receiver = Account.objects.get(id=int(iban[12:23]))
-			if sender == receiver:
-				raise exceptions.ValidationError('errors.transfer_to_self')
-		except Account.DoesNotExist:
-			receiver = Account.objects.get(full_name='__BANK_TRANSFER__')
+		receiver = account_for_iban(iban) or system_accounts.get_account(system_accounts.BANK_TRANSFER)
+		if sender == receiver:
+			raise exceptions.ValidationError('errors.transfer_to_self')
 		
 		return super().create(
 			{
@@ -259,8 +300,80 @@ class CardSerializer(serializers.ModelSerializer):
 	expiry_date = serializers.DateField(read_only=True)
 
 	def get_number(self, obj):
-		return id_to_card_number(obj.id)
+		return obj.number or id_to_card_number(obj.id)
 
 	class Meta:
 		model = Card
-		fields = ['id', 'name', 'number', 'expiry_date', 'cvv', 'pin_code', 'online_payments', 'nfc_payments']
\ No newline at end of file
+		fields = ['id', 'name', 'number', 'expiry_date', 'cvv', 'pin_code', 'online_payments', 'nfc_payments', 'blocked']
+		read_only_fields = ['blocked']
+
+class CardAuthorizationSerializer(serializers.ModelSerializer):
+	'''Authorizes a card payment from a terminal, placing a hold for the amount on the card's account'''
+	card_number = serializers.CharField(min_length=16, max_length=16, write_only=True)
+	channel = serializers.ChoiceField(['ONLINE', 'NFC', 'CHIP'], write_only=True)
+	expiry_date = serializers.CharField(min_length=5, max_length=5, write_only=True, required=False) # MM/YY, required online
+	cvv = serializers.IntegerField(write_only=True, required=False) # Required online
+	pin_code = serializers.IntegerField(write_only=True, required=False) # Required on CHIP and above CARD_CONTACTLESS_LIMIT on NFC
+	amount = serializers.IntegerField(min_value=1)
+
+	class Meta:
+		model = Hold
+		fields = ['id', 'card_number', 'channel', 'expiry_date', 'cvv', 'pin_code', 'amount', 'merchant', 'status', 'expires_at', 'transfer', 'created_at']
+		read_only_fields = ['status', 'expires_at', 'transfer']
+
+	def create(self, validated_data):
+		number = validated_data['card_number']
+		card = card_index.lookup(number)
+		if card is None:
+			raise exceptions.ValidationError('errors.invalid_card')
+		if card.blocked:
+			raise exceptions.ValidationError('errors.card_blocked')
+		if card.expiry_date < timezone.localdate():
+			raise exceptions.ValidationError('errors.card_expired')
+
+		channel = validated_data['channel']
+		checked = False
+		if channel == 'ONLINE':
+			if not card.online_payments:
+				raise exceptions.ValidationError('errors.online_payments_disabled')
+			if not _matches(validated_data.get('cvv'), card.cvv) or not _matches(validated_data.get('expiry_date'), card.expiry_date.strftime('%m/%y')):
+				raise _failed_attempt(card, number, 'errors.invalid_card_details')
+			checked = True
+		else:
+			if channel == 'NFC' and not card.nfc_payments:
+				raise exceptions.ValidationError('errors.nfc_payments_disabled')
+			if channel == 'NFC' and 'pin_code' not in validated_data and validated_data['amount'] > settings.CARD_CONTACTLESS_LIMIT:
+				raise exceptions.ValidationError('errors.pin_required')
+			if channel == 'CHIP' or 'pin_code' in validated_data:
+				if not _matches(validated_data.get('pin_code'), card.pin_code):
+					raise _failed_attempt(card, number, 'errors.invalid_pin')
+				checked = True
+
+		if checked:
+			# The index may be stale when another process blocked the card, so the DB has the last word
+			if not Card.objects.filter(id=card.card_id, blocked=False).update(failed_attempts=0):
+				card_index.evict(number)
+				raise exceptions.ValidationError('errors.card_blocked')
+			if card.failed_attempts:
+				card_index.evict(number)
+		return holds.place(
+			card.account_id,
+			validated_data['amount'],
+			card_id=card.card_id,
+			merchant=validated_data.get('merchant', ''),
+			terminal=terminal_id(self.context['request'])
+		)
+
+def _matches(given, expected):
+	return given is not None and hmac.compare_digest(str(given), str(expected))
+
+def _failed_attempt(card, number, error):
+	'''Counts a wrong PIN or card details and returns the error to raise, the card is blocked after CARD_MAX_FAILED_ATTEMPTS in a row'''
+	with transaction.atomic():
+		Card.objects.filter(id=card.card_id).update(failed_attempts=models.F('failed_attempts') + 1)
+		Card.objects.filter(id=card.card_id, failed_attempts__gte=settings.CARD_MAX_FAILED_ATTEMPTS).update(blocked=True)
+	card_index.evict(number) # Updates send no signal
+	return exceptions.ValidationError(error)
+
+class HoldCaptureSerializer(serializers.Serializer):
+	amount = serializers.IntegerField(min_value=1, required=False) # Defaults to the whole hold
@@ -0,0 +1,258 @@
+from collections import defaultdict
+from itertools import islice
+
+from dateutil.relativedelta import relativedelta
+from rest_framework import exceptions, status
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import shards, snapshots
+from .models import Account, DirectDebit, StandingOrder, Transfer
+
+class BatchRejected(exceptions.APIException):
+	'''400 with the {index, status, error} results of the rejected items, indexes stay ints (unlike in a ValidationError)'''
+	status_code = status.HTTP_400_BAD_REQUEST
+	default_code = 'batch_rejected'
+
+	def __init__(self, atomic, results):
+		self.detail = {'atomic' : atomic, 'results' : [result for result in results if result['status'] == 'REJECTED']}
+
+def lock_accounts(sender_ids, receiver_ids):
+	'''
+	Lock the given accounts in ascending id order (so concurrent batches can't deadlock) and return them by id.
+	Sharded receivers are credited through their shards and are not locked.
+	'''
+	account_ids = set(sender_ids) | (set(receiver_ids) - shards.sharded_account_ids())
+	accounts = Account.objects.select_for_update().filter(id__in=account_ids).order_by('id')
+	return {account.id : account for account in accounts}
+
+def apply_balance_deltas(deltas):
+	'''Given {account_id : delta}, update every balance in a single UPDATE statement (plus one per credited sharded account)'''
+	sharded = shards.sharded_account_ids()
+	for account_id, delta in deltas.items():
+		if account_id in sharded and delta > 0:
+			shards.credit(account_id, delta)
+	deltas = {account_id : delta for account_id, delta in deltas.items() if delta and not (account_id in sharded and delta > 0)}
+	if not deltas:
+		return
+	Account.objects.filter(id__in=deltas.keys()).update(
+		balance=models.F('balance') + models.Case(
+			*[models.When(id=account_id, then=models.Value(delta)) for account_id, delta in deltas.items()],
+			default=models.Value(0),
+			output_field=models.BigIntegerField()
+		)
+	)
+
+def account_names(accounts, account_ids):
+	'''Full names of the given accounts for the denormalized transfer names, reusing the locked rows and fetching the others in one query'''
+	names = {account_id : account.full_name for account_id, account in accounts.items()}
+	missing = set(account_ids) - names.keys()
+	if missing:
+		names.update(Account.objects.filter(id__in=missing).values_list('id', 'full_name'))
+	return names
+
+def record_snapshots(accounts, deltas):
+	'''Snapshot the new balance of every locked account a chunk moved money on'''
+	snapshots.record({account_id : account.balance + deltas[account_id] for account_id, account in accounts.items() if deltas.get(account_id)})
+
+def _chunks(rows, chunk_size, key):
+	'''Split rows into chunks of roughly chunk_size, never splitting rows that share the same key'''
+	chunk = []
+	for row in rows:
+		if len(chunk) >= chunk_size and key(chunk[-1]) != key(row):
+			yield chunk
+			chunk = []
+		chunk.append(row)
+	if chunk:
+		yield chunk
+
+def debit_step(frequency, anchor):
+	'''Time between two debits, monthly and yearly orders keep the anchor's day (clamped to the end of shorter months)'''
+	return {
+		StandingOrder.Frequency.DAILY : relativedelta(days=1),
+		StandingOrder.Frequency.WEEKLY : relativedelta(weeks=1),
+		StandingOrder.Frequency.MONTHLY : relativedelta(months=1, day=anchor.day),
+		StandingOrder.Frequency.YEARLY : relativedelta(years=1, month=anchor.month, day=anchor.day),
+	}[frequency]
+
+def next_debit_date(order, now):
+	'''Return the first debit date after now, anchored on the day the order was created so monthly orders don't drift'''
+	step = debit_step(order.frequency, order.created_at)
+	next_debit = order.next_debit + step
+	while next_debit <= now:
+		next_debit += step
+	return next_debit
+
+def _settle_standing_orders(order_ids, now):
+	'''Settle a chunk of due standing orders in one transaction, returning (settled, failed)'''
+	with transaction.atomic():
+		# Skip orders another runner is settling and re-check they are still due
+		orders = list(
+			StandingOrder.objects.select_for_update(skip_locked=True)
+			.filter(id__in=order_ids, next_debit__lte=now)
+			.order_by('sender_id', 'id')
+		)
+		accounts = lock_accounts({order.sender_id for order in orders}, {order.receiver_id for order in orders})
+		names = account_names(accounts, {order.receiver_id for order in orders})
+
+		deltas = defaultdict(int)
+		settled = []
+		transfers = []
+		for order in orders:
+			if accounts[order.sender_id].available + deltas[order.sender_id] < order.amount:
+				continue # Insufficient balance, the order stays due and is retried on the next run
+			deltas[order.sender_id] -= order.amount
+			deltas[order.receiver_id] += order.amount
+			transfers.append(Transfer(
+				sender_id=order.sender_id,
+				receiver_id=order.receiver_id,
+				amount=order.amount,
+				metadata={**order.metadata, 'standing_order' : order.id},
+				sender_name=names[order.sender_id],
+				receiver_name=names[order.receiver_id]
+			))
+			settled.append(order)
+
+		apply_balance_deltas(deltas)
+		record_snapshots(accounts, deltas)
+		Transfer.objects.bulk_create(transfers)
+
+		updated_at = timezone.now()
+		for order, transfer in zip(settled, transfers):
+			order.last_debit = transfer
+			order.next_debit = next_debit_date(order, now)
+			order.updated_at = updated_at
+		StandingOrder.objects.bulk_update(settled, ['last_debit', 'next_debit', 'updated_at'])
+		return len(settled), len(orders) - len(settled)
+
+def run_standing_orders(now=None, chunk_size=500):
+	'''Settle every standing order due at the given time, returning (settled, failed)'''
+	now = now or timezone.now()
+	due = StandingOrder.objects.filter(next_debit__lte=now).order_by('sender_id', 'id').values_list('id', 'sender_id')
+	total_settled = total_failed = 0
+	for chunk in _chunks(list(due), chunk_size, key=lambda row: row[1]):
+		settled, failed = _settle_standing_orders([order_id for order_id, _ in chunk], now)
+		total_settled += settled
+		total_failed += failed
+	return total_settled, total_failed
+
+def _parse_direct_debit_row(row):
+	'''Return (direct_debit_id, amount) for a batch row, or None if it is malformed'''
+	try:
+		direct_debit_id, amount = (int(value) for value in row)
+	except (TypeError, ValueError):
+		return None
+	if amount <= 0:
+		return None
+	return direct_debit_id, amount
+
+def _collect_direct_debits(rows, reject):
+	'''Settle a chunk of batch rows in one transaction, returning the number of collected debits'''
+	parsed = []
+	for row in rows:
+		values = _parse_direct_debit_row(row)
+		if values is None:
+			reject(row, 'errors.invalid_row')
+		else:
+			parsed.append((row, *values))
+
+	with transaction.atomic():
+		debits = DirectDebit.objects.filter(active=True).in_bulk({direct_debit_id for _, direct_debit_id, _ in parsed})
+		accounts = lock_accounts({debit.sender_id for debit in debits.values()}, {debit.receiver_id for debit in debits.values()})
+		names = account_names(accounts, {debit.receiver_id for debit in debits.values()})
+
+		deltas = defaultdict(int)
+		transfers = []
+		last_debits = {}
+		for row, direct_debit_id, amount in parsed:
+			debit = debits.get(direct_debit_id)
+			if debit is None:
+				reject(row, 'errors.invalid_direct_debit')
+				continue
+			if accounts[debit.sender_id].available + deltas[debit.sender_id] < amount:
+				reject(row, 'errors.insufficient_balance')
+				continue
+			deltas[debit.sender_id] -= amount
+			deltas[debit.receiver_id] += amount
+			transfer = Transfer(
+				sender_id=debit.sender_id,
+				receiver_id=debit.receiver_id,
+				amount=amount,
+				metadata={'type' : 'DIRECT_DEBIT', 'direct_debit' : direct_debit_id},
+				sender_name=names[debit.sender_id],
+				receiver_name=names[debit.receiver_id]
+			)
+			transfers.append(transfer)
+			last_debits[direct_debit_id] = transfer # A debit collected twice in one batch keeps the latest transfer
+
+		apply_balance_deltas(deltas)
+		record_snapshots(accounts, deltas)
+		Transfer.objects.bulk_create(transfers)
+		if last_debits:
+			DirectDebit.objects.filter(id__in=last_debits.keys()).update(
+				last_debit=models.Case(
+					*[models.When(id=direct_debit_id, then=models.Value(transfer.id)) for direct_debit_id, transfer in last_debits.items()],
+					output_field=models.BigIntegerField()
+				),
+				updated_at=timezone.now()
+			)
+		return len(transfers)
+
+def collect_direct_debits(rows, reject, chunk_size=500):
+	'''
+	Collect a stream of (direct_debit_id, amount) rows in chunked bulk transactions.
+	Rows that can't be collected are passed to reject(row, reason) instead of aborting the batch.
+	'''
+	rows = iter(rows)
+	collected = 0
+	while True:
+		chunk = list(islice(rows, chunk_size))
+		if not chunk:
+			return collected
+		collected += _collect_direct_debits(chunk, reject)
+
+def settle_batch(sender_id, items, atomic=True):
+	'''
+	Transfer from the sender to every {receiver, amount, notes} item with a single lock, balance UPDATE and bulk_create.
+	When atomic, any rejected item rejects the whole batch, otherwise the valid items go through.
+	Returns one {index, status, id | error} result per item, raises BatchRejected when nothing went through.
+	'''
+	with transaction.atomic():
+		receiver_ids = {item['receiver'] for item in items}
+		accounts = lock_accounts({sender_id}, receiver_ids)
+		names = account_names(accounts, receiver_ids | {sender_id})
+
+		deltas = defaultdict(int)
+		results = []
+		transfers = []
+		for index, item in enumerate(items):
+			if item['receiver'] == sender_id:
+				results.append({'index' : index, 'status' : 'REJECTED', 'error' : 'errors.transfer_to_self'})
+				continue
+			if accounts[sender_id].available + deltas[sender_id] < item['amount']:
+				results.append({'index' : index, 'status' : 'REJECTED', 'error' : 'errors.insufficient_balance'})
+				continue
+			deltas[sender_id] -= item['amount']
+			deltas[item['receiver']] += item['amount']
+			transfers.append(Transfer(
+				sender_id=sender_id,
+				receiver_id=item['receiver'],
+				amount=item['amount'],
+				notes=item.get('notes'),
+				metadata={'type' : 'BATCH'},
+				sender_name=names[sender_id],
+				receiver_name=names[item['receiver']]
+			))
+			results.append({'index' : index, 'status' : 'OK', 'transfer' : transfers[-1]})
+
+		if not transfers or (atomic and len(transfers) != len(items)):
+			raise BatchRejected(atomic, results)
+
+		apply_balance_deltas(deltas)
+		record_snapshots(accounts, deltas)
+		Transfer.objects.bulk_create(transfers)
+		for result in results:
+			if 'transfer' in result:
+				result['id'] = result.pop('transfer').id
+		return results
@@ -0,0 +1,50 @@
+'''
+Sharded balances for the high-volume system accounts listed in settings.SHARDED_ACCOUNTS.
+
+Credits to those accounts go to one of settings.ACCOUNT_SHARDS AccountShard rows picked at random,
+so concurrent payments lock different rows. fold() moves the shard balances back into Account.balance.
+'''
+from random import randrange
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+
+from . import snapshots, system_accounts
+from .models import Account, AccountShard
+
+def sharded_account_ids():
+	return {system_accounts.get_id(name) for name in settings.SHARDED_ACCOUNTS}
+
+def _credit_shard(account_id, amount):
+	shard = randrange(settings.ACCOUNT_SHARDS)
+	if AccountShard.objects.filter(account_id=account_id, shard=shard).update(balance=models.F('balance') + amount):
+		return
+	try:
+		with transaction.atomic():
+			AccountShard.objects.create(account_id=account_id, shard=shard, balance=amount)
+	except IntegrityError:
+		# Another payment created the shard first
+		AccountShard.objects.filter(account_id=account_id, shard=shard).update(balance=models.F('balance') + amount)
+
+def credit(account_id, amount):
+	'''Add amount to the account, on a random shard if it is a sharded account'''
+	if account_id in sharded_account_ids():
+		_credit_shard(account_id, amount)
+	else:
+		Account.objects.filter(id=account_id).update(balance=models.F('balance') + amount)
+
+def total_balance(account_id):
+	'''Balance of the account including credits that haven't been folded yet'''
+	balance = Account.objects.values_list('balance', flat=True).get(id=account_id)
+	return balance + (AccountShard.objects.filter(account_id=account_id).aggregate(total=models.Sum('balance'))['total'] or 0)
+
+def fold(account_id):
+	'''Move every shard balance of the account into Account.balance, returning the amount moved'''
+	with transaction.atomic():
+		shards = list(AccountShard.objects.select_for_update().filter(account_id=account_id, balance__gt=0).order_by('shard'))
+		total = sum(shard.balance for shard in shards)
+		if total:
+			AccountShard.objects.filter(id__in=[shard.id for shard in shards]).update(balance=0)
+			Account.objects.filter(id=account_id).update(balance=models.F('balance') + total)
+			snapshots.record_accounts([account_id])
+		return total
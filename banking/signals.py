@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import card_index, checksums, response_cache
+from .models import Account, Address, Card, TelcoProvider
+
+@receiver([post_save, post_delete], sender=TelcoProvider)
+def _evict_telco_providers(sender, instance, **kwargs):
+	response_cache.evict(response_cache.TELCO_PROVIDERS)
+
+@receiver([post_save, post_delete], sender=Account)
+def _evict_account(sender, instance, **kwargs):
+	response_cache.evict(response_cache.account_key(instance.id))
+
+@receiver([post_save, post_delete], sender=Address)
+def _evict_account_address(sender, instance, **kwargs):
+	account_ids = Account.objects.filter(address_id=instance.id).values_list('id', flat=True)
+	response_cache.evict(*[response_cache.account_key(account_id) for account_id in account_ids])
+
+@receiver([post_save, post_delete], sender=Card)
+def _evict_card(sender, instance, **kwargs):
+	card_index.evict(instance.number or checksums.card_number_for_id(instance.id)) # Cards not backfilled yet are indexed by the computed number
@@ -0,0 +1,69 @@
+'''
+Daily closing balances, kept up to date by every code path that moves money.
+
+Sharded accounts are snapshotted when their shards are folded, since their balance isn't final before then.
+'''
+import logging
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .models import Account, BalanceSnapshot, Transfer
+
+logger = logging.getLogger(__name__)
+
+def record(balances, date=None):
+	'''Upsert {account_id : balance} as the closing balances of the given day (today by default)'''
+	date = date or timezone.localdate()
+	BalanceSnapshot.objects.bulk_create(
+		[BalanceSnapshot(account_id=account_id, date=date, balance=balance) for account_id, balance in balances.items()],
+		update_conflicts=True,
+		unique_fields=['account_id', 'date'],
+		update_fields=['balance']
+	)
+
+def record_accounts(account_ids, date=None):
+	'''Snapshot the current balance of the given accounts'''
+	record(dict(Account.objects.filter(id__in=account_ids).values_list('id', 'balance')), date)
+
+def backfill(chunk_size=2000):
+	'''
+	Rebuild every snapshot by replaying the whole transfer history in date order, streaming it in chunks.
+	Returns the number of snapshots written and [(account_id, date, balance)] for the days the history puts an account
+	below zero, which means it has drifted (see reconcile_balances). Those days are logged and not written.
+	'''
+	transfers = Transfer.objects.order_by('date', 'id').values_list('date', 'sender_id', 'receiver_id', 'amount', 'metadata__type')
+	balances = defaultdict(int)
+	touched = set()
+	pending = {}
+	written = 0
+	negative = []
+	day = None
+	for date, sender_id, receiver_id, amount, transfer_type in transfers.iterator(chunk_size=chunk_size):
+		date = timezone.localdate(date)
+		if date != day:
+			pending.update({(account_id, day) : balances[account_id] for account_id in touched})
+			touched.clear()
+			day = date
+			if len(pending) >= chunk_size:
+				written += _flush(pending, negative)
+		if transfer_type != 'WELCOMEGIFT': # Welcome gifts are never debited from __UPBANK__
+			balances[sender_id] -= amount
+			touched.add(sender_id)
+		balances[receiver_id] += amount
+		touched.add(receiver_id)
+	pending.update({(account_id, day) : balances[account_id] for account_id in touched})
+	return written + _flush(pending, negative), negative
+
+def _flush(pending, negative):
+	'''Write the pending snapshots and empty it, negative balances go to the negative list instead'''
+	snapshots = []
+	for (account_id, date), balance in pending.items():
+		if balance < 0:
+			logger.warning('Account %s has a negative balance of %s on %s', account_id, balance, date)
+			negative.append((account_id, date, balance))
+		else:
+			snapshots.append(BalanceSnapshot(account_id=account_id, date=date, balance=balance))
+	BalanceSnapshot.objects.bulk_create(snapshots, update_conflicts=True, unique_fields=['account_id', 'date'], update_fields=['balance'])
+	pending.clear()
+	return len(snapshots)
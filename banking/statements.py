@@ -0,0 +1,41 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+FORMATS = {
+	'csv' : ('text/csv', 'csv'),
+	'ndjson' : ('application/x-ndjson', 'ndjson'),
+	'text' : ('text/plain', 'txt'),
+}
+
+COLUMNS = ['date', 'type', 'name', 'amount', 'notes', 'category']
+
+class _Echo:
+	'''File-like object that hands back what csv.writer writes, so rows can be streamed one at a time'''
+	def write(self, value):
+		return value
+
+def _rows(queryset, account_id, chunk_size):
+	transfers = queryset.order_by('-id').values_list('date', 'sender_id', 'sender_name', 'receiver_name', 'amount', 'notes', 'metadata')
+	for date, sender_id, sender_name, receiver_name, amount, notes, metadata in transfers.iterator(chunk_size=chunk_size):
+		if sender_id == account_id:
+			yield [date, 'EXPENSE', receiver_name, amount, notes or '', (metadata or {}).get('type', '')]
+		else:
+			yield [date, 'INCOME', sender_name, amount, notes or '', (metadata or {}).get('type', '')]
+
+def stream(queryset, account_id, file_format, chunk_size=2000):
+	'''Given a transfer queryset, yields the statement of the account line by line, reading the transfers with a server-side cursor'''
+	rows = _rows(queryset, account_id, chunk_size)
+	if file_format == 'csv':
+		writer = csv.writer(_Echo())
+		yield writer.writerow(COLUMNS)
+		for row in rows:
+			yield writer.writerow([row[0].isoformat(), *row[1:]])
+	elif file_format == 'ndjson':
+		for row in rows:
+			yield json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder) + '\n'
+	else:
+		yield f'{"Date":<24} {"Type":<8} {"Name":<40} {"Amount":>12}  Notes\n'
+		for date, transfer_type, name, amount, notes, _ in rows:
+			yield f'{date:%Y-%m-%d %H:%M:%S%z} {transfer_type:<8} {name[:40]:<40} {amount:>12}  {notes}\n'
@@ -0,0 +1,47 @@
+'''
+Process-wide registry of the well-known system accounts.
+
+Ids come from settings.SYSTEM_ACCOUNTS when configured, otherwise every missing account
+is resolved in a single query the first time one is needed and kept for the life of the process. Names without an
+account are remembered too, looking them up raises ImproperlyConfigured without querying again.
+'''
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import Account
+
+UPBANK = '__UPBANK__'
+BANK_TRANSFER = '__BANK_TRANSFER__'
+SERVICE_PAYMENT = '__SERVICE_PAYMENT__'
+GOVERNMENT_PAYMENT = '__GOVERNMENT_PAYMENT__'
+
+NAMES = (UPBANK, BANK_TRANSFER, SERVICE_PAYMENT, GOVERNMENT_PAYMENT)
+
+_ids = {}
+
+def _load(*names):
+	ids = dict.fromkeys((*NAMES, *names)) # None until found
+	ids.update(settings.SYSTEM_ACCOUNTS)
+	missing = [name for name, account_id in ids.items() if account_id is None]
+	if missing:
+		# Reverse order so the oldest account wins if a name was ever created twice
+		for full_name, account_id in Account.objects.filter(full_name__in=missing).order_by('-id').values_list('full_name', 'id'):
+			ids[full_name] = account_id
+	_ids.update(ids)
+
+def get_id(name):
+	'''Return the id of the given system account, loading the registry on first use'''
+	if name not in _ids:
+		_load(name)
+	account_id = _ids.get(name)
+	if account_id is None:
+		raise ImproperlyConfigured(f'System account {name} does not exist, create it or set its id in SYSTEM_ACCOUNTS')
+	return account_id
+
+def get_account(name):
+	'''Return an unsaved reference to the given system account, usable as a foreign key or in balance updates (never call save() on it)'''
+	return Account(id=get_id(name), full_name=name)
+
+def invalidate():
+	'''Forget every resolved id, the next lookup reloads them'''
+	_ids.clear()
@@ -1,3 +1,737 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import luhn
+
+from django.conf import settings
+from django.db import connection
+from django.db import models
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from knox.models import AuthToken
+from rest_framework.test import APIClient
+
+from upbank import profiling
+
+from . import card_index, checksums, holds, ledger, provisioning, queries, reconciliation, shards, snapshots, statements, system_accounts, validators_pt
+from .accounts import account_for_iban
+from .functions import id_to_card_number, id_to_iban
+from .models import Account, AccountShard, BalanceSnapshot, Card, DirectDebit, Hold, LedgerEntry, StandingOrder, Transfer
+from .settlement import apply_balance_deltas, collect_direct_debits, run_standing_orders
+
+class TransferHistoryTests(TestCase):
+	def setUp(self):
+		user = get_user_model().objects.create(username='ana@upbank.pt', email='ana@upbank.pt')
+		self.account = Account.objects.create(full_name='Ana', user=user)
+		self.other = Account.objects.create(full_name='Rui')
+		self.client = APIClient()
+		self.client.force_authenticate(user)
+
+	def add_transfers(self, count):
+		'''Adds count transfers of the user (one in three incoming) with distinct amounts, plus count unrelated ones'''
+		expense = {'sender' : self.account, 'sender_name' : 'Ana', 'receiver' : self.other, 'receiver_name' : 'Rui'}
+		income = {'sender' : self.other, 'sender_name' : 'Rui', 'receiver' : self.account, 'receiver_name' : 'Ana'}
+		Transfer.objects.bulk_create([Transfer(**(expense if i % 3 else income), amount=i + 1, metadata={}) for i in range(count)])
+		Transfer.objects.bulk_create([Transfer(sender=self.other, receiver=self.other, amount=1, metadata={}) for _ in range(count)])
+
+	def test_pages_match_full_ordering(self):
+		self.add_transfers(45)
+		amounts = []
+		url = '/api/transfers/?pageSize=10'
+		while url:
+			response = self.client.get(url).json()
+			self.assertLessEqual(len(response['results']), 10)
+			amounts += [transfer['amount'] for transfer in response['results']]
+			url = response['next']
+		self.assertEqual(amounts, list(range(45, 0, -1)))
+
+		previous = self.client.get(self.client.get('/api/transfers/?pageSize=10').json()['next']).json()['previous']
+		self.assertEqual([transfer['amount'] for transfer in self.client.get(previous).json()['results']], list(range(45, 35, -1)))
+
+	def test_async_history_matches_full_ordering(self):
+		self.add_transfers(25)
+		_, token = AuthToken.objects.create(self.account.user)
+		headers = {'HTTP_AUTHORIZATION' : f'Token {token}', 'secure' : True}
+		amounts = []
+		url = '/api/async/transfers/?pageSize=10'
+		while url:
+			response = self.client.get(url, **headers).json()
+			amounts += [transfer['amount'] for transfer in response['results']]
+			url = response['next']
+		self.assertEqual(amounts, list(range(25, 0, -1)))
+		self.assertEqual(self.client.get(f'/api/async/accounts/{self.account.id}/', **headers).json()['fullName'], 'Ana')
+		self.assertEqual(self.client.get(f'/api/async/accounts/{self.other.id}/', **headers).status_code, 404)
+		self.assertEqual(self.client.get('/api/async/cards/').status_code, 401)
+
+	def test_profile_etag_follows_writes(self):
+		url = f'/api/accounts/{self.account.id}/'
+		etag = self.client.get(url)['ETag']
+		self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+		Account.objects.filter(id=self.account.id).update(balance=500) # No signal, the balance is merged in fresh
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual((response.status_code, response.json()['balance']), (200, 500))
+
+		self.account.refresh_from_db()
+		self.account.full_name = 'Ana Maria'
+		self.account.save()
+		self.assertEqual(self.client.get(url).json()['fullName'], 'Ana Maria')
+
+	def test_page_queries_do_not_grow_with_volume(self):
+		self.add_transfers(20)
+		with CaptureQueriesContext(connection) as small:
+			self.client.get('/api/transfers/?pageSize=10')
+		self.add_transfers(500)
+		with CaptureQueriesContext(connection) as large:
+			self.client.get('/api/transfers/?pageSize=10')
+		self.assertEqual(len(small), len(large))
+
+	@skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite query plan, Postgres picks its plan from table statistics')
+	def test_history_scans_use_composite_indexes(self):
+		sent = Transfer.objects.filter(sender=self.account).order_by('-id').values_list('id', flat=True)[:11]
+		received = Transfer.objects.filter(receiver=self.account).order_by('-id').values_list('id', flat=True)[:11]
+		self.assertIn('transfer_sender_idx', sent.explain())
+		self.assertIn('transfer_receiver_idx', received.explain())
+		self.assertNotIn('TEMP B-TREE', sent.explain() + received.explain()) # Rows come out of the index already ordered
+
+	def test_latest_ids_match_the_full_ordering(self):
+		self.add_transfers(30)
+		history = Transfer.objects.filter(Q(sender=self.account) | Q(receiver=self.account))
+		for position, reverse in [(None, False), (20, False), (5, True)]:
+			expected = history.filter(**({} if position is None else {'id__gt' if reverse else 'id__lt' : position}))
+			expected = list(expected.order_by('id' if reverse else '-id').values_list('id', flat=True)[:10])
+			self.assertEqual(sorted(queries.latest_transfer_ids(Transfer.objects.all(), self.account, 10, position, reverse), reverse=not reverse), expected)
+
+	@skipUnlessDBFeature('supports_slicing_ordering_in_compound')
+	def test_latest_ids_are_one_union_query(self):
+		self.add_transfers(30)
+		ids = queries.latest_transfer_ids(Transfer.objects.all(), self.account, 10)
+		self.assertIn('UNION', str(ids.query))
+		with self.assertNumQueries(1):
+			ids = sorted(ids, reverse=True)
+		history = Transfer.objects.filter(Q(sender=self.account) | Q(receiver=self.account))
+		self.assertEqual(ids, list(history.order_by('-id').values_list('id', flat=True)[:10]))
+
+	def test_create_transfer(self):
+		Account.objects.filter(id=self.account.id).update(balance=100)
+		response = self.client.post('/api/transfers/', {'receiver' : self.other.id, 'amount' : 30}, format='json')
+		self.assertEqual(response.status_code, 201, response.content)
+		self.assertEqual(response.json()['metadata'], {'type' : 'INTERNAL'})
+		self.assertEqual(self.client.post('/api/transfers/', {'receiver' : self.account.id, 'amount' : 30}, format='json').json(), ['errors.transfer_to_self'])
+		self.assertEqual(list(Account.objects.filter(id__in=[self.account.id, self.other.id]).order_by('id').values_list('balance', flat=True)), [70, 30])
+
+	def export(self, output, **params):
+		response = self.client.get('/api/transfers/export/', {'output' : output, **params})
+		self.assertTrue(response.streaming)
+		return b''.join(response.streaming_content).decode()
+
+	def test_csv_export(self):
+		self.add_transfers(30)
+		rows = list(csv.reader(io.StringIO(self.export('csv'))))
+		self.assertEqual(rows[0], statements.COLUMNS)
+		self.assertEqual([int(row[3]) for row in rows[1:]], list(range(30, 0, -1))) # The 30 unrelated transfers of 1 are left out
+		self.assertEqual({(row[1], row[2]) for row in rows[1:]}, {('EXPENSE', 'Rui'), ('INCOME', 'Rui')})
+
+	def test_ndjson_export(self):
+		self.add_transfers(30)
+		lines = [json.loads(line) for line in self.export('ndjson', type='INCOME').splitlines()]
+		self.assertEqual([line['amount'] for line in lines], list(range(28, 0, -3)))
+		self.assertEqual({(line['type'], line['name']) for line in lines}, {('INCOME', 'Rui')})
+		self.assertEqual(set(lines[0]), set(statements.COLUMNS))
+		self.assertEqual(self.client.get('/api/transfers/export/', {'output' : 'xlsx'}).status_code, 400)
+
+	def test_search_by_counterparty(self):
+		shop = Account.objects.create(full_name='Mercearia Lisboa')
+		Transfer.objects.create(sender=self.account, receiver=shop, amount=1, metadata={})
+		Transfer.objects.create(sender=shop, receiver=self.account, amount=2, metadata={})
+		Transfer.objects.create(sender=self.account, receiver=self.other, amount=3, metadata={})
+		Transfer.objects.create(sender=shop, receiver=self.other, amount=4, metadata={})
+		for term, amounts in [('mercearia', [2, 1]), ('Ru', [3]), ('Ana', [])]:
+			response = self.client.get('/api/transfers/', {'fromTo' : term}).json()
+			self.assertEqual([transfer['amount'] for transfer in response['results']], amounts)
+
+	def test_page_query_count(self):
+		self.add_transfers(100)
+		self.client.force_authenticate(get_user_model().objects.get(id=self.account.user_id)) # Without the account cached on it
+		# Account, page ids (one UNION query, or one scan per side where compound LIMITs aren't supported) and the page itself
+		expected = 3 if connection.features.supports_slicing_ordering_in_compound else 4
+		with self.assertNumQueries(expected):
+			response = self.client.get('/api/transfers/?pageSize=50')
+		self.assertEqual(len(response.json()['results']), 50)
+		self.assertEqual({transfer['type'] for transfer in response.json()['results']}, {'EXPENSE', 'INCOME'})
+		self.assertEqual({transfer['name'] for transfer in response.json()['results']}, {'Rui'})
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AuthenticationTests(TestCase):
+	SIGNUP = {
+		'email' : 'ines@upbank.pt',
+		'password' : 'correct-horse-battery',
+		'fullName' : 'Ines Costa',
+		'birthdate' : '1990-01-01',
+		'address' : {'lineOne' : 'Rua Augusta 1', 'postalCode' : '1100-048', 'city' : 'Lisboa', 'district' : 'Lisboa'},
+		'taxNumber' : '123456789',
+		'idNumber' : '12345678',
+	}
+
+	def test_async_signup_and_login(self):
+		response = self.client.post('/api/async/auth/signup', self.SIGNUP, content_type='application/json')
+		self.assertEqual(response.status_code, 201, response.content)
+		self.assertEqual(response.json()['balance'], settings.DEFAULT_BALANCE)
+		self.assertEqual(self.client.post('/api/async/auth/signup', self.SIGNUP, content_type='application/json').status_code, 400)
+
+		self.assertEqual(self.client.post('/api/async/auth/login', {'username' : 'ines@upbank.pt', 'password' : 'wrong'}, content_type='application/json').status_code, 400)
+		response = self.client.post('/api/async/auth/login', {'username' : 'ines@upbank.pt', 'password' : 'correct-horse-battery'}, content_type='application/json')
+		self.assertEqual(response.status_code, 200, response.content)
+		accounts = self.client.get('/api/accounts/', HTTP_AUTHORIZATION=f'Token {response.json()["token"]}')
+		self.assertEqual(accounts.json()[0]['fullName'], 'Ines Costa')
+
+	@override_settings(PASSWORD_HASHING_WORKERS=1)
+	def test_login_hashes_on_pool(self):
+		get_user_model().objects.create_user('rui@upbank.pt', 'rui@upbank.pt', 'correct-horse-battery')
+		self.assertEqual(self.client.post('/api/auth/login', {'username' : 'rui@upbank.pt', 'password' : 'wrong'}).status_code, 400)
+		self.assertEqual(self.client.post('/api/auth/login', {'username' : 'rui@upbank.pt', 'password' : 'correct-horse-battery'}).status_code, 200)
+
+	def test_cached_token_authentication(self):
+		user = get_user_model().objects.create_user('rui@upbank.pt', 'rui@upbank.pt', 'correct-horse-battery')
+		Account.objects.create(full_name='Rui', user=user)
+		token = self.client.post('/api/auth/login', {'username' : 'rui@upbank.pt', 'password' : 'correct-horse-battery'}).json()['token']
+		headers = {'HTTP_AUTHORIZATION' : f'Token {token}'}
+		self.assertEqual(self.client.get('/api/cards/', **headers).status_code, 200)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.client.get('/api/cards/', **headers).status_code, 200)
+		self.assertFalse([query for query in queries if 'knox_authtoken' in query['sql']])
+		self.assertEqual(len(queries), 2) # The user joined with their account, then the cards
+
+		self.assertEqual(self.client.post('/api/auth/logout', **headers).status_code, 204)
+		self.assertEqual(self.client.get('/api/cards/', **headers).status_code, 401)
+
+class ChecksumTests(SimpleTestCase):
+	'''The table driven checksums must agree with validators_pt and the luhn package they replace'''
+	def setUp(self):
+		generator = random.Random(97)
+		self.ids = [0, 1, 96, 97, 10 ** 9 - 1] + [generator.randrange(10 ** 9) for _ in range(2000)]
+		self.numbers = [''.join(generator.choice('0123456789') for _ in range(generator.choice([9, 16, 21]))) for _ in range(5000)]
+
+	def test_generated_numbers_match(self):
+		for account_id in self.ids:
+			nib = checksums.NIB_PREFIX + str(account_id).zfill(11)
+			self.assertEqual(checksums.iban_for_id(account_id), f'PT50{nib}{validators_pt.generateControlNIB(nib):02d}')
+			self.assertEqual(checksums.card_number_for_id(account_id), luhn.append(checksums.CARD_PREFIX + str(account_id).zfill(9)))
+		self.assertEqual(checksums.ibans_for_ids(self.ids), [checksums.iban_for_id(account_id) for account_id in self.ids])
+		self.assertEqual(checksums.card_numbers_for_ids(self.ids), [checksums.card_number_for_id(account_id) for account_id in self.ids])
+
+	def test_ids_must_fit_the_number(self):
+		self.assertEqual(len(checksums.iban_for_id(10 ** 11 - 1)), 25)
+		self.assertEqual(len(checksums.card_number_for_id(10 ** 9 - 1)), 16)
+		for generate, limit in [(checksums.iban_for_id, 10 ** 11), (checksums.card_number_for_id, 10 ** 9)]:
+			for account_id in (limit, -1):
+				with self.assertRaises(ValueError):
+					generate(account_id)
+		with self.assertRaises(ValueError):
+			checksums.ibans_for_ids([1, 10 ** 11])
+		with self.assertRaises(ValueError):
+			checksums.card_numbers_for_ids([1, 10 ** 9])
+
+	def test_validation_matches(self):
+		ibans = checksums.ibans_for_ids(self.ids)
+		for number in self.numbers + [iban[4:] for iban in ibans]:
+			self.assertEqual(checksums.valid_nib(number), validators_pt.controlNIB(number), number)
+			self.assertEqual(checksums.valid_nif(number), validators_pt.controlNIF(number), number)
+			self.assertEqual(checksums.valid_card_number(number), luhn.verify(number), number)
+		corrupted = [iban[:10] + str((int(iban[10]) + 1) % 10) + iban[11:] for iban in ibans]
+		self.assertEqual(checksums.valid_ibans(ibans + corrupted + ['GB00' + ibans[0][4:]]), [True] * len(ibans) + [False] * (len(corrupted) + 1))
+		with self.assertRaises(ValueError):
+			checksums.valid_iban('GB00' + ibans[0][4:])
+
+class AccountNumberTests(TestCase):
+	def test_numbers_are_stored_and_backfilled(self):
+		account = Account.objects.create(full_name='Ana')
+		card = Card.objects.create(account=account, name='__VIRTUAL_CARD__', expiry_date='2030-01-01', cvv=123, pin_code=1234)
+		self.assertEqual((account.iban, card.number), (id_to_iban(account.id), id_to_card_number(card.id)))
+
+		Account.objects.filter(id=account.id).update(iban=None)
+		Card.objects.filter(id=card.id).update(number=None)
+		self.assertEqual(account_for_iban(account.iban), account) # Found by id until backfilled
+		provisioning.backfill_numbers(chunk_size=2)
+		self.assertFalse(Account.objects.filter(iban__isnull=True).exists())
+		self.assertEqual(Card.objects.get(id=card.id).number, card.number)
+
+	def test_iban_routing_checks_the_bank(self):
+		account = Account.objects.create(full_name='Ana')
+		self.assertEqual(account_for_iban(account.iban), account)
+		# Same account digits at another bank, with valid check digits
+		nib = '0035' + account.iban[8:23]
+		other_bank = f'PT50{nib}{checksums.nib_check(nib):02d}'
+		self.assertTrue(checksums.valid_iban(other_bank))
+		self.assertIsNone(account_for_iban(other_bank))
+
+@override_settings(CARD_TERMINAL_KEYS=['terminal-key', 'other-terminal-key'])
+class CardAuthorizationTests(TestCase):
+	def setUp(self):
+		card_index.clear()
+		self.account = Account.objects.create(full_name='Ana', balance=1000)
+		self.card = Card.objects.create(account=self.account, name='__PHYSICAL_CARD__', expiry_date='2099-12-31', cvv=123, pin_code=1234)
+		self.client = APIClient(HTTP_TERMINAL_KEY='terminal-key')
+
+	def authorize(self, amount, **fields):
+		data = {'cardNumber' : self.card.number, 'channel' : 'CHIP', 'pinCode' : 1234, 'amount' : amount, **fields}
+		return self.client.post('/api/card-authorizations/', {name : value for name, value in data.items() if value is not None}, format='json')
+
+	def test_authorization_places_hold(self):
+		self.assertEqual(self.authorize(300).status_code, 201)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(self.authorize(300, merchant='Cafe').status_code, 201)
+		self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and 'banking_card' in query['sql']]) # Answered from the card index
+		self.account.refresh_from_db()
+		self.assertEqual((self.account.reserved, self.account.available), (600, 400))
+		self.assertEqual(self.authorize(500).json(), ['errors.insufficient_balance'])
+		self.assertEqual(ledger.reservation_drift(), {})
+
+	def test_cards_not_backfilled_are_found_by_id(self):
+		Card.objects.filter(id=self.card.id).update(number=None)
+		self.assertEqual(self.authorize(1).status_code, 201)
+		corrupted = self.card.number[:-1] + str((int(self.card.number[-1]) + 1) % 10)
+		self.assertEqual(self.client.post('/api/card-authorizations/', {'cardNumber' : corrupted, 'channel' : 'CHIP', 'pinCode' : 1234, 'amount' : 1}, format='json').json(), ['errors.invalid_card'])
+
+		card = Card.objects.get(id=self.card.id)
+		card.nfc_payments = False
+		card.save() # Evicts the card indexed by its computed number, and stores the number
+		self.assertEqual(self.authorize(1, channel='NFC').json(), ['errors.nfc_payments_disabled'])
+		self.assertEqual(Card.objects.get(id=self.card.id).number, self.card.number)
+
+	def test_declines(self):
+		self.assertEqual(APIClient().post('/api/card-authorizations/', {}, format='json').status_code, 403)
+		self.assertEqual(self.authorize(1, pinCode=4321).json(), ['errors.invalid_pin'])
+		self.assertEqual(self.authorize(1, channel='ONLINE', cvv=123, expiryDate='11/99').json(), ['errors.invalid_card_details'])
+		self.assertEqual(self.authorize(1, channel='ONLINE', cvv=123, expiryDate='12/99').status_code, 201)
+
+		self.assertEqual(self.authorize(1, channel='NFC').status_code, 201)
+		self.card.nfc_payments = False
+		self.card.save() # Evicts the indexed card
+		self.assertEqual(self.authorize(1, channel='NFC').json(), ['errors.nfc_payments_disabled'])
+
+	@override_settings(CARD_CONTACTLESS_LIMIT=100)
+	def test_contactless_limit(self):
+		self.assertEqual(self.authorize(100, channel='NFC', pinCode=None).status_code, 201)
+		self.assertEqual(self.authorize(101, channel='NFC', pinCode=None).json(), ['errors.pin_required'])
+		self.assertEqual(self.authorize(101, channel='NFC', pinCode=4321).json(), ['errors.invalid_pin'])
+		self.assertEqual(self.authorize(101, channel='NFC', pinCode=1234).status_code, 201)
+		self.account.refresh_from_db()
+		self.assertEqual(self.account.reserved, 201)
+
+	@override_settings(CARD_MAX_FAILED_ATTEMPTS=3)
+	def test_failed_attempts_block_the_card(self):
+		for _ in range(2):
+			self.assertEqual(self.authorize(1, pinCode=1111).json(), ['errors.invalid_pin'])
+		self.assertEqual(self.authorize(1).status_code, 201) # A right PIN resets the count
+		self.assertEqual(Card.objects.get(id=self.card.id).failed_attempts, 0)
+
+		self.assertEqual(self.authorize(1, pinCode=1111).json(), ['errors.invalid_pin'])
+		self.assertEqual(self.authorize(1, channel='ONLINE', cvv=999, expiryDate='12/99').json(), ['errors.invalid_card_details'])
+		self.assertEqual(self.authorize(1, pinCode=2222).json(), ['errors.invalid_pin'])
+		self.assertEqual(self.authorize(1).json(), ['errors.card_blocked'])
+		self.assertEqual(self.authorize(1, channel='NFC').json(), ['errors.card_blocked'])
+		self.assertTrue(Card.objects.get(id=self.card.id).blocked)
+
+	def test_blocked_card_in_a_stale_index(self):
+		self.assertEqual(self.authorize(1).status_code, 201)
+		Card.objects.filter(id=self.card.id).update(blocked=True) # By another process, this one's index still has the card
+		self.assertEqual(self.authorize(1).json(), ['errors.card_blocked'])
+		self.assertEqual(self.authorize(1, channel='ONLINE', cvv=123, expiryDate='12/99').json(), ['errors.card_blocked'])
+		self.assertEqual(Hold.objects.count(), 1)
+
+	def test_unblock(self):
+		Card.objects.filter(id=self.card.id).update(blocked=True, failed_attempts=3)
+		self.assertEqual(self.authorize(1).json(), ['errors.card_blocked'])
+		user = get_user_model().objects.create_user('ana@upbank.pt', 'ana@upbank.pt', 'correct-horse-battery')
+		Account.objects.filter(id=self.account.id).update(user=user)
+		owner = APIClient()
+		owner.force_authenticate(user)
+		response = owner.post(f'/api/cards/{self.card.id}/unblock/')
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(response.json()['blocked'])
+		self.assertEqual(Card.objects.get(id=self.card.id).failed_attempts, 0)
+		self.assertEqual(self.authorize(1).status_code, 201)
+
+		other = get_user_model().objects.create_user('rui@upbank.pt', 'rui@upbank.pt', 'correct-horse-battery')
+		Account.objects.create(full_name='Rui', user=other)
+		stranger = APIClient()
+		stranger.force_authenticate(other)
+		self.assertEqual(stranger.post(f'/api/cards/{self.card.id}/unblock/').status_code, 404)
+
+	def test_capture_release_and_expiry(self):
+		captured, released, expiring = (self.authorize(amount).json()['id'] for amount in (300, 200, 100))
+		response = self.client.post(f'/api/card-authorizations/{captured}/capture/', {'amount' : 250}, format='json')
+		self.assertEqual(response.json()['status'], 'CAPTURED')
+		self.assertEqual(Transfer.objects.get(id=response.json()['transfer']).amount, 250)
+		self.assertEqual(self.client.post(f'/api/card-authorizations/{captured}/release/').json(), ['errors.hold_not_active'])
+		self.assertEqual(self.client.post(f'/api/card-authorizations/{released}/release/').json()['status'], 'RELEASED')
+		other_terminal = APIClient(HTTP_TERMINAL_KEY='other-terminal-key')
+		for action in ('capture', 'release'):
+			self.assertEqual(other_terminal.post(f'/api/card-authorizations/{expiring}/{action}/').status_code, 404)
+		self.assertEqual(Hold.objects.get(id=expiring).status, Hold.Status.ACTIVE)
+
+		self.account.refresh_from_db()
+		self.assertEqual((self.account.balance, self.account.reserved), (750, 100))
+		self.assertEqual(holds.expire(now=timezone.now()), 0)
+		self.assertEqual(holds.expire(now=timezone.now() + settings.HOLD_TTL), 1)
+		self.assertEqual(Hold.objects.get(id=expiring).status, Hold.Status.EXPIRED)
+		self.account.refresh_from_db()
+		self.assertEqual(self.account.reserved, 0)
+		self.assertEqual(ledger.reservation_drift(), {})
+
+class StandingOrderTests(TestCase):
+	def setUp(self):
+		self.sender = Account.objects.create(full_name='Ana', balance=1000)
+		self.receiver = Account.objects.create(full_name='Rui')
+
+	def order(self, created_at, next_debit, frequency=StandingOrder.Frequency.MONTHLY):
+		order = StandingOrder.objects.create(sender=self.sender, receiver=self.receiver, amount=100, frequency=frequency, metadata={}, next_debit=next_debit)
+		StandingOrder.objects.filter(id=order.id).update(created_at=created_at) # auto_now_add
+		return order
+
+	def test_only_due_orders_are_settled(self):
+		now = timezone.now()
+		due = self.order(now - timedelta(days=40), now - timedelta(days=1))
+		later = self.order(now, now + timedelta(days=1))
+		self.assertEqual(run_standing_orders(now=now), (1, 0))
+		self.assertEqual(run_standing_orders(now=now), (0, 0))
+		due.refresh_from_db()
+		self.assertGreater(due.next_debit, now)
+		self.assertIsNotNone(due.last_debit)
+		self.assertIsNone(StandingOrder.objects.get(id=later.id).last_debit)
+		self.sender.refresh_from_db()
+		self.assertEqual(self.sender.balance, 900)
+
+	def test_monthly_orders_keep_the_end_of_the_month(self):
+		january = datetime(2027, 1, 31, 9, tzinfo=dt_timezone.utc)
+		order = self.order(january, january)
+		for now, expected in [(january, datetime(2027, 2, 28, 9)), (datetime(2027, 2, 28, 9), datetime(2027, 3, 31, 9))]:
+			run_standing_orders(now=now.replace(tzinfo=dt_timezone.utc))
+			order.refresh_from_db()
+			self.assertEqual(order.next_debit, expected.replace(tzinfo=dt_timezone.utc))
+		self.assertEqual(Transfer.objects.filter(sender=self.sender).count(), 2)
+
+class DirectDebitTests(TestCase):
+	def setUp(self):
+		self.payer = Account.objects.create(full_name='Ana', balance=100)
+		self.other = Account.objects.create(full_name='Ines', balance=100)
+		utility = Account.objects.create(full_name='EDP')
+		self.debits = [DirectDebit.objects.create(sender=sender, receiver=utility) for sender in (self.payer, self.other)]
+
+	def test_rejections_are_reported(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		directory = directory.name
+		batch, report = os.path.join(directory, 'batch.csv'), os.path.join(directory, 'rejections.csv')
+		with open(batch, 'w') as file:
+			file.write(f'{self.debits[0].id},60\n{self.debits[0].id},60\n{self.debits[1].id},30\nnot,a row\n999999,10\n')
+		call_command('collect_direct_debits', batch, rejections=report, stdout=io.StringIO())
+		with open(report, newline='') as file:
+			self.assertEqual(list(csv.reader(file)), [
+				['direct_debit', 'amount', 'reason'],
+				['not', 'a row', 'errors.invalid_row'],
+				[str(self.debits[0].id), '60', 'errors.insufficient_balance'],
+				['999999', '10', 'errors.invalid_direct_debit'],
+			])
+		self.payer.refresh_from_db()
+		self.other.refresh_from_db()
+		self.assertEqual((self.payer.balance, self.other.balance), (40, 70))
+
+	def test_last_debits_are_set_in_one_statement(self):
+		rows = [(self.debits[0].id, 10), (self.debits[1].id, 20), (self.debits[0].id, 30)]
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(collect_direct_debits(rows, reject=self.fail), 3)
+		self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "banking_directdebit"')]), 1)
+		last_debits = dict(DirectDebit.objects.values_list('id', 'last_debit__amount'))
+		self.assertEqual(last_debits, {self.debits[0].id : 30, self.debits[1].id : 20}) # The latest of a debit collected twice
+
+class SystemAccountTests(TestCase):
+	def setUp(self):
+		system_accounts.invalidate()
+		self.addCleanup(system_accounts.invalidate)
+
+	def test_ids_are_resolved_once(self):
+		expected = {name : Account.objects.filter(full_name=name).order_by('id').values_list('id', flat=True)[:1].get() for name in system_accounts.NAMES}
+		with self.assertNumQueries(1):
+			self.assertEqual({name : system_accounts.get_id(name) for name in system_accounts.NAMES}, expected)
+		with self.assertNumQueries(0):
+			system_accounts.get_id(system_accounts.UPBANK)
+
+	def test_missing_accounts_are_not_queried_again(self):
+		with self.assertNumQueries(1):
+			for _ in range(3):
+				with self.assertRaises(ImproperlyConfigured):
+					system_accounts.get_id('__MISSING__')
+
+class BalanceSnapshotTests(TestCase):
+	def test_backfill_reports_negative_balances(self):
+		ana, rui = Account.objects.create(full_name='Ana'), Account.objects.create(full_name='Rui')
+		Transfer.objects.create(sender=rui, receiver=ana, amount=100, metadata={})
+		Transfer.objects.create(sender=ana, receiver=rui, amount=30, metadata={})
+		with self.assertLogs('banking.snapshots', 'WARNING'):
+			written, negative = snapshots.backfill()
+		self.assertEqual(written, 1)
+		self.assertEqual(negative, [(rui.id, timezone.localdate(), -70)]) # Rui sent 100 without ever receiving it
+		self.assertEqual(list(BalanceSnapshot.objects.values_list('account_id', 'balance')), [(ana.id, 70)])
+		with self.assertRaises(CommandError), self.assertLogs('banking.snapshots', 'WARNING'):
+			call_command('backfill_balance_snapshots', stdout=io.StringIO())
+
+class BatchTransferTests(TestCase):
+	def setUp(self):
+		user = get_user_model().objects.create(username='ana@upbank.pt', email='ana@upbank.pt')
+		self.account = Account.objects.create(full_name='Ana', user=user, balance=100)
+		self.receivers = [Account.objects.create(full_name=name) for name in ('Rui', 'Ines')]
+		self.client = APIClient()
+		self.client.force_authenticate(user)
+
+	def batch(self, amounts, atomic):
+		items = [{'receiver' : receiver.id, 'amount' : amount} for receiver, amount in zip(self.receivers, amounts)]
+		return self.client.post('/api/batch-transfers/', {'transfers' : items, 'atomic' : atomic}, format='json')
+
+	def balances(self):
+		return list(Account.objects.filter(id__in=[self.account.id, *(receiver.id for receiver in self.receivers)]).order_by('id').values_list('balance', flat=True))
+
+	def test_atomic_batch_rolls_back(self):
+		response = self.batch([60, 50], atomic=True)
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json(), {'atomic' : True, 'results' : [{'index' : 1, 'status' : 'REJECTED', 'error' : 'errors.insufficient_balance'}]})
+		self.assertEqual(self.balances(), [100, 0, 0])
+		self.assertFalse(Transfer.objects.exists())
+
+	def test_partial_batch_settles_valid_items(self):
+		response = self.batch([60, 50], atomic=False)
+		self.assertEqual(response.status_code, 201)
+		results = response.json()['results']
+		self.assertEqual([(result['index'], result['status']) for result in results], [(0, 'OK'), (1, 'REJECTED')])
+		self.assertEqual(Transfer.objects.get().id, results[0]['id'])
+		self.assertEqual(self.balances(), [40, 60, 0])
+
+	def test_batch_without_settled_items_is_rejected(self):
+		response = self.batch([150, 101], atomic=False)
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual([(result['index'], result['error']) for result in response.json()['results']], [(0, 'errors.insufficient_balance'), (1, 'errors.insufficient_balance')])
+		self.assertEqual(self.balances(), [100, 0, 0])
+
+	def test_idempotency_lease_outlives_a_dead_request(self):
+		caches['idempotency'].clear()
+		send = lambda: self.client.post('/api/batch-transfers/', {'transfers' : [{'receiver' : self.receivers[0].id, 'amount' : 10}]}, format='json', HTTP_IDEMPOTENCY_KEY='payroll-1')
+		with mock.patch('banking.settlement.settle_batch', side_effect=SystemExit), self.assertRaises(SystemExit):
+			send() # The worker dies without releasing the key
+		self.assertEqual(send().status_code, 409)
+
+		later = time.time() + settings.IDEMPOTENCY_LEASE + 1
+		with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+			self.assertEqual(send().status_code, 201)
+		with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later + settings.IDEMPOTENCY_LEASE + 1):
+			self.assertEqual(send()['Idempotent-Replayed'], 'true') # Completed responses are kept longer
+		self.assertEqual(self.balances(), [90, 10, 0])
+
+class ReconciliationTests(TestCase):
+	def setUp(self):
+		self.ana, self.rui = Account.objects.create(full_name='Ana', balance=100), Account.objects.create(full_name='Rui')
+		Transfer.objects.create(sender=system_accounts.get_account(system_accounts.UPBANK), receiver=self.ana, amount=100, metadata={'type' : 'WELCOMEGIFT'}) # Not debited
+
+	def pay(self, sender, receiver, amount, metadata):
+		apply_balance_deltas({sender.id : -amount, receiver.id : amount})
+		Transfer.objects.create(sender=sender, receiver=receiver, amount=amount, metadata=metadata)
+
+	def reconcile(self):
+		return call_command('reconcile_balances', workers=1, chunk_size=2, stdout=io.StringIO())
+
+	def test_clean_and_untyped_transfers(self):
+		self.pay(self.ana, self.rui, 30, {'type' : 'TRANSFER'})
+		self.pay(self.ana, self.rui, 1, {}) # No type key
+		self.pay(self.rui, self.ana, 5, {'notes' : 'lunch'})
+		self.assertEqual(reconciliation.account_drift(self.ana.id, self.rui.id), [])
+		self.reconcile()
+
+	def test_drift_is_reported(self):
+		self.pay(self.ana, self.rui, 1, {})
+		Account.objects.filter(id=self.rui.id).update(balance=models.F('balance') + 5)
+		self.assertEqual(reconciliation.account_drift(self.ana.id, self.rui.id), [(self.rui.id, 6, 1)])
+		with self.assertRaisesMessage(CommandError, '1 accounts have drifted'):
+			self.reconcile()
+
+	def test_unfolded_shards_and_pending_ledger_entries(self):
+		bank = system_accounts.get_account(system_accounts.BANK_TRANSFER)
+		self.pay(self.ana, bank, 10, {'type' : 'BANK_TRANSFER'}) # Credited to a shard
+		ledger.post_transfer(self.ana, self.rui, 20, metadata={})
+		self.assertTrue(AccountShard.objects.filter(account=bank, balance=10).exists())
+		self.reconcile()
+		shards.fold(bank.id)
+		ledger.materialize()
+		self.reconcile()
+
+class ProfilingTests(TestCase):
+	def setUp(self):
+		user = get_user_model().objects.create(username='ana@upbank.pt', email='ana@upbank.pt')
+		account = Account.objects.create(full_name='Ana', user=user)
+		Transfer.objects.bulk_create([Transfer(sender=account, receiver=account, amount=1, metadata={}) for _ in range(5)])
+		self.client = APIClient()
+		self.client.force_authenticate(user)
+		profiling.histogram.reset()
+		self.addCleanup(profiling.histogram.reset)
+
+	@override_settings(PROFILING=False, MIDDLEWARE=['upbank.profiling.ProfilingMiddleware', *settings.MIDDLEWARE])
+	def test_disabled(self):
+		self.assertNotIn('Server-Timing', self.client.get('/api/cards/'))
+		self.assertEqual(profiling.histogram.snapshot(), {})
+
+	@override_settings(PROFILING=True, MIDDLEWARE=['upbank.profiling.ProfilingMiddleware', *settings.MIDDLEWARE])
+	def test_enabled(self):
+		self.assertRegex(self.client.get('/api/cards/')['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+		self.assertEqual(profiling.histogram.snapshot()['GET card-list']['count'], 1)
+
+		response = self.client.get('/api/transfers/export/')
+		self.assertIn('Server-Timing', response)
+		self.assertNotIn('GET transfer-export', profiling.histogram.snapshot()) # Recorded once streamed
+		self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 6)
+		stats = profiling.histogram.snapshot()['GET transfer-export']
+		self.assertEqual(stats['count'], 1)
+		self.assertGreater(stats['max_queries'], int(re.search(r'"(\d+) queries"', response['Server-Timing'])[1])) # Including the streamed ones
+
+class ImportAccountsTests(TestCase):
+	ROW = {
+		'password' : 'correct-horse-battery',
+		'full_name' : 'Ines Costa',
+		'birthdate' : '1990-01-01',
+		'tax_number' : '123456789',
+		'id_number' : '12345678',
+		'line_one' : 'Rua Augusta 1',
+		'line_two' : '',
+		'postal_code' : '1100-048',
+		'city' : 'Lisboa',
+		'district' : 'Lisboa',
+	}
+
+	def import_rows(self, rows):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		customers, report = os.path.join(directory.name, 'customers.csv'), os.path.join(directory.name, 'rejections.csv')
+		with open(customers, 'w', newline='') as file:
+			writer = csv.DictWriter(file, provisioning.COLUMNS)
+			writer.writeheader()
+			writer.writerows(rows)
+		call_command('import_accounts', customers, rejections=report, workers=1, chunk_size=2, stdout=io.StringIO())
+		with open(report, newline='') as file:
+			return list(csv.reader(file))[1:]
+
+	def test_valid_rows_are_provisioned(self):
+		self.assertEqual(self.import_rows([{**self.ROW, 'email' : f'cliente{i}@upbank.pt'} for i in range(3)]), [])
+		accounts = Account.objects.filter(user__email__startswith='cliente')
+		self.assertEqual(accounts.count(), 3)
+		for account in accounts:
+			self.assertEqual((account.balance, account.iban, account.address.city), (settings.DEFAULT_BALANCE, id_to_iban(account.id), 'Lisboa'))
+			self.assertEqual(sorted(account.card_set.values_list('name', flat=True)), ['__PHYSICAL_CARD__', '__VIRTUAL_CARD__'])
+			self.assertTrue(account.user.check_password('correct-horse-battery'))
+		self.assertEqual(reconciliation.account_drift(accounts.first().id, accounts.last().id), [])
+
+	def test_invalid_and_duplicate_rows_are_rejected(self):
+		get_user_model().objects.create(username='existing@upbank.pt', email='existing@upbank.pt')
+		rejections = self.import_rows([
+			{**self.ROW, 'email' : 'ok@upbank.pt'},
+			{**self.ROW, 'email' : 'not-an-email'},
+			{**self.ROW, 'email' : 'minor@upbank.pt', 'birthdate' : timezone.localdate().isoformat()},
+			{**self.ROW, 'email' : 'nif@upbank.pt', 'tax_number' : '123456780'},
+			{**self.ROW, 'email' : 'existing@upbank.pt'},
+			{**self.ROW, 'email' : 'ok@upbank.pt'}, # Already imported in an earlier chunk
+			{**self.ROW, 'email' : 'twice@upbank.pt'},
+			{**self.ROW, 'email' : 'twice@upbank.pt'}, # Twice in the same chunk
+			{**self.ROW, 'email' : 'missing@upbank.pt', 'city' : ''},
+		])
+		self.assertEqual([(row, email) for row, email, _ in rejections], [
+			('2', 'not-an-email'), ('3', 'minor@upbank.pt'), ('4', 'nif@upbank.pt'), ('5', 'existing@upbank.pt'),
+			('6', 'ok@upbank.pt'), ('8', 'twice@upbank.pt'), ('9', 'missing@upbank.pt'),
+		])
+		self.assertEqual(rejections[0][2], 'errors.invalid_email')
+		self.assertEqual({reason for _, _, reason in rejections[3:6]}, {'errors.duplicate_email'})
+		self.assertEqual(rejections[6][2], 'errors.missing_fields')
+		self.assertEqual(set(Account.objects.filter(user__isnull=False).values_list('user__email', flat=True)), {'ok@upbank.pt', 'twice@upbank.pt'})
+
+class AccountShardTests(TestCase):
+	def test_credits_are_folded(self):
+		bank = system_accounts.get_id(system_accounts.BANK_TRANSFER)
+		balance = Account.objects.get(id=bank).balance
+		with mock.patch('banking.shards.randrange', side_effect=[0, 1, 0, 2]): # Two credits land on the same shard
+			for amount in (10, 20, 30, 40):
+				shards.credit(bank, amount)
+		self.assertEqual(Account.objects.get(id=bank).balance, balance)
+		self.assertEqual(dict(AccountShard.objects.filter(account_id=bank).values_list('shard', 'balance')), {0 : 40, 1 : 20, 2 : 40})
+		self.assertEqual(shards.total_balance(bank), balance + 100)
+
+		call_command('fold_account_shards', stdout=io.StringIO())
+		self.assertEqual(Account.objects.get(id=bank).balance, balance + 100)
+		self.assertFalse(AccountShard.objects.filter(account_id=bank, balance__gt=0).exists())
+		self.assertEqual(BalanceSnapshot.objects.get(account_id=bank, date=timezone.localdate()).balance, balance + 100)
+		self.assertEqual(shards.fold(bank), 0)
+
+		ana = Account.objects.create(full_name='Ana')
+		shards.credit(ana.id, 5) # Not sharded, credited in place
+		self.assertEqual((Account.objects.get(id=ana.id).balance, ana.shards.count()), (5, 0))
+
+@override_settings(LEDGER_MODE=True)
+class LedgerModeTests(TestCase):
+	def setUp(self):
+		user = get_user_model().objects.create(username='ana@upbank.pt', email='ana@upbank.pt')
+		self.ana = Account.objects.create(full_name='Ana', user=user, balance=100)
+		self.rui = Account.objects.create(full_name='Rui')
+		self.client = APIClient()
+		self.client.force_authenticate(user)
+
+	def transfer(self, amount):
+		return self.client.post('/api/transfers/', {'receiver' : self.rui.id, 'amount' : amount}, format='json')
+
+	def state(self, account):
+		account.refresh_from_db()
+		return account.balance, account.reserved
+
+	def assertConsistent(self):
+		call_command('reconcile_ledger', stdout=io.StringIO())
+
+	def test_transfers_reserve_then_materialize(self):
+		self.assertEqual(self.transfer(30).status_code, 201)
+		self.assertEqual(self.state(self.ana), (100, 30)) # Reserved, not yet debited
+		self.assertEqual(self.state(self.rui), (0, 0))
+		transfer = Transfer.objects.get()
+		self.assertEqual(sorted(transfer.ledger_entries.values_list('account_id', 'amount', 'materialized')), sorted([(self.ana.id, -30, False), (self.rui.id, 30, False)]))
+
+		self.assertEqual(self.transfer(80).json(), ['errors.insufficient_balance']) # Only 70 are available
+		self.assertEqual(self.transfer(70).status_code, 201)
+		self.assertEqual(self.state(self.ana), (100, 100))
+		self.assertConsistent()
+
+		call_command('materialize_ledger', stdout=io.StringIO())
+		self.assertEqual((self.state(self.ana), self.state(self.rui)), ((0, 0), (100, 0)))
+		self.assertFalse(LedgerEntry.objects.filter(materialized=False).exists())
+		self.assertConsistent()
+
+	def test_hold_capture_goes_through_the_ledger(self):
+		bank = Account.objects.get(id=system_accounts.get_id(system_accounts.BANK_TRANSFER))
+		bank_balance = bank.balance
+		hold = holds.place(self.ana.id, 60)
+		self.assertEqual(self.state(self.ana), (100, 60))
+		hold = holds.capture(hold.id, '', 45)
+		self.assertEqual(self.state(self.ana), (100, 45)) # The hold is gone, the capture's debit is pending
+		self.assertEqual(sorted(hold.transfer.ledger_entries.values_list('amount', flat=True)), [-45, 45])
+		self.assertConsistent()
+
+		ledger.materialize()
+		self.assertEqual(self.state(self.ana), (55, 0))
+		self.assertEqual(self.state(bank), (bank_balance + 45, 0))
+		self.assertConsistent()
@@ -1,11 +1,14 @@
 from django.urls import path, include
-from . import views
+from . import async_views, views
 from rest_framework import routers
 
 api = routers.DefaultRouter()
 api.register('accounts', views.AccountView, basename='account')
 api.register('transfers', views.TransferView, basename='transfer')
+api.register('batch-transfers', views.BatchTransferView, basename='batch-transfer')
+api.register('balance-history', views.BalanceHistoryView, basename='balance-history')
 api.register('cards', views.CardView, basename='card')
+api.register('card-authorizations', views.CardAuthorizationView, basename='card-authorization')
 api.register('bank-transfers', views.BankTransferView, basename='bank-transfer')
 api.register('service-payments', views.ServicePaymentView, basename='service-payment')
 api.register('government-payments', views.GovernmentPaymentView, basename='government-payment')
@@ -16,4 +19,8 @@ api.register('direct-debits', views.DirectDebitView, basename='direct-debit')
 
 urlpatterns = [
 	path('', include(api.urls)),
+	path('async/transfers/', async_views.transfers, name='async-transfer-list'),
+	path('async/accounts/<int:pk>/', async_views.account_detail, name='async-account-detail'),
+	path('async/cards/', async_views.cards, name='async-card-list'),
+	path('async/telco-providers/', async_views.telco_providers, name='async-telco-provider-list'),
 ]
\ No newline at end of file
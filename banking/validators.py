@@ -1,5 +1,5 @@
 from rest_framework import exceptions
-from .validators_pt import controlIBAN, controlNIF
+from . import checksums
 from dateutil.relativedelta import relativedelta
 import datetime
 
@@ -23,7 +23,7 @@ def clean_postalcode(postal_code):
 def clean_taxnumber(tax_number):
 	'''Given a tax number as an int, validate the tax number against the portuguese standard'''
 	try:
-		if not controlNIF(tax_number):
+		if not checksums.valid_nif(tax_number):
 			raise exceptions.ValidationError("errors.invalid_tax_number")
 
 	except ValueError as e:
@@ -32,7 +32,7 @@ def clean_taxnumber(tax_number):
 def clean_iban(iban_number):
 	'''Given an IBAN as a string, validate the IBAN against the portuguese standard'''
 	try:
-		if not controlIBAN(iban_number):
+		if not checksums.valid_iban(iban_number):
 			raise exceptions.ValidationError("errors.invalid_iban")
 
 	except ValueError as e:
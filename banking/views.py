@@ -1,11 +1,16 @@
 
 from rest_framework import viewsets, mixins, pagination
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
-from banking.permissions import IsAuthenticatedOrCreating
-from . import serializers, models
+from banking.idempotency import IdempotentCreateMixin
+from banking.permissions import HasTerminalKey, IsAuthenticatedOrCreating, terminal_id
+from . import holds, serializers, models, queries, response_cache, statements
+from .accounts import request_account
 
 from django.db import transaction
+from django.http import StreamingHttpResponse
 
 class AccountView(viewsets.ModelViewSet):
 	'''Allows user to manage their own accounts'''
@@ -18,6 +23,11 @@ class AccountView(viewsets.ModelViewSet):
 			return models.Account.objects.none()
 		return self.queryset.filter(user=self.request.user)
 	
+	def retrieve(self, request, *args, **kwargs):
+		account = self.get_object()
+		data, etag = response_cache.get_or_set(response_cache.account_key(account.id), lambda: dict(self.get_serializer(account).data))
+		return response_cache.respond_with_balance(request, data, etag, account.balance)
+
 	def perform_destroy(self, instance):
 		with transaction.atomic():
 			if instance.select_for_update().balance != 0:
@@ -30,8 +40,8 @@ class TransferPagination(pagination.CursorPagination):
 	max_page_size = 50
 	ordering = '-id'
 
-class TransferView(viewsets.ModelViewSet):
-	queryset = models.Transfer.objects.prefetch_related('sender', 'receiver')
+class TransferView(IdempotentCreateMixin, viewsets.ModelViewSet):
+	queryset = models.Transfer.objects.all() # Names are denormalized on the transfer, no need to load the accounts
 	serializer_class = serializers.TransferSerializer
 	pagination_class = TransferPagination
 
@@ -39,63 +49,128 @@ class TransferView(viewsets.ModelViewSet):
 		'''Given a min date, a max date, a type ("EXPENSE" or "INCOME") and a sender/reciever, returns a list of transfers'''
 		if self.request.user.is_anonymous:
 			return models.Transfer.objects.none()
-		user_account = models.Account.objects.get(user=self.request.user)
+		user_account = request_account(self.request) # The serializer reuses it
 		result = self.queryset
+
+		min_date = self.request.query_params.get('minDate', None)
+		if (min_date is not None):
+			result = result.filter(date__gte=min_date)
+		
+		max_date = self.request.query_params.get('maxDate', None)
+		if (max_date is not None):
+			result = result.filter(date__lte=max_date)
+		
+		sender_receiver = self.request.query_params.get('fromTo', None)
+		if (sender_receiver is not None):
+			result = queries.counterparty_filter(result, user_account, sender_receiver)
+
 		transfer_type = self.request.query_params.get('type', None)
 		if (transfer_type is not None):
 			if (transfer_type == "EXPENSE"):
-				result = result.filter(sender=user_account)
+				return result.filter(sender=user_account)
 			elif (transfer_type == "INCOME"):
-				result = result.filter(receiver=user_account)
+				return result.filter(receiver=user_account)
 			else:
 				raise ValidationError(f"Invalid transfer type: {transfer_type}")
-		else:
-			result = result.filter(sender=user_account) | self.queryset.filter(receiver=user_account)
+		
+		if self.action == 'list':
+			# Only fetch the rows of the requested page, see queries.latest_transfer_ids
+			cursor = self.paginator.decode_cursor(self.request) or pagination.Cursor(offset=0, reverse=False, position=None)
+			limit = cursor.offset + self.paginator.get_page_size(self.request) + 1
+			return self.queryset.filter(id__in=queries.latest_transfer_ids(result, user_account, limit, cursor.position, cursor.reverse))
+		return result.filter(sender=user_account) | result.filter(receiver=user_account)
+
+	@action(detail=False, methods=['get'])
+	def export(self, request):
+		'''Streams every transfer matching the list filters as a "csv" (default), "ndjson" or "text" statement, given by the output parameter'''
+		file_format = request.query_params.get('output', 'csv')
+		if file_format not in statements.FORMATS:
+			raise ValidationError(f"Invalid output format: {file_format}")
+		content_type, extension = statements.FORMATS[file_format]
+		response = StreamingHttpResponse(statements.stream(self.get_queryset(), request_account(request).id, file_format), content_type=content_type)
+		response['Content-Disposition'] = f'attachment; filename="statement.{extension}"'
+		return response
+
+class BatchTransferView(IdempotentCreateMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
+	serializer_class = serializers.BatchTransferSerializer
+
+class BalanceHistoryView(mixins.ListModelMixin, viewsets.GenericViewSet):
+	serializer_class = serializers.BalanceSnapshotSerializer
+
+	def get_queryset(self):
+		'''Given a min date and a max date, returns the closing balance of every day with transfers in that range'''
+		result = models.BalanceSnapshot.objects.filter(account=request_account(self.request))
 
 		min_date = self.request.query_params.get('minDate', None)
 		if (min_date is not None):
 			result = result.filter(date__gte=min_date)
-		
+
 		max_date = self.request.query_params.get('maxDate', None)
 		if (max_date is not None):
 			result = result.filter(date__lte=max_date)
-		
-		sender_receiver = self.request.query_params.get('fromTo', None)
-		if (sender_receiver is not None):
-			result = result.filter(sender__full_name__icontains=sender_receiver) | result.filter(receiver__full_name__icontains=sender_receiver)
-		
-		return result
 
-class BankTransferView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+		return result.order_by('date')
+
+class BankTransferView(IdempotentCreateMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.BankTransferSerializer
 
-class ServicePaymentView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+class ServicePaymentView(IdempotentCreateMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.ServicePaymentSerializer
 
-class GovernmentPaymentView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+class GovernmentPaymentView(IdempotentCreateMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.GovernmentPaymentSerializer
 
-class TelcoPaymentView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+class TelcoPaymentView(IdempotentCreateMixin, mixins.CreateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.TelcoPaymentSerializer
 
 class TelcoProviderView(mixins.ListModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.TelcoProviderSerializer
 	queryset = models.TelcoProvider.objects.all()
 
+	def list(self, request, *args, **kwargs):
+		data, etag = response_cache.get_or_set(response_cache.TELCO_PROVIDERS, lambda: list(self.get_serializer(self.get_queryset(), many=True).data))
+		return response_cache.respond(request, data, etag)
+
 class StandingOrderView(viewsets.ModelViewSet):
 	serializer_class = serializers.StandingOrderSerializer
 	
 	def get_queryset(self):
-		return models.StandingOrder.objects.filter(sender=self.request.user.account).prefetch_related('receiver')
+		return models.StandingOrder.objects.filter(sender=request_account(self.request)).prefetch_related('receiver')
 
 class DirectDebitView(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.DirectDebitSerializer
 	
 	def get_queryset(self):
-		return models.DirectDebit.objects.filter(sender=self.request.user.account).prefetch_related('receiver')
+		return models.DirectDebit.objects.filter(sender=request_account(self.request)).prefetch_related('receiver')
 
 class CardView(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
 	serializer_class = serializers.CardSerializer
 	
 	def get_queryset(self):
-		return models.Card.objects.filter(account=self.request.user.account)
\ No newline at end of file
+		return models.Card.objects.filter(account=request_account(self.request))
+
+	@action(detail=True, methods=['post'])
+	def unblock(self, request, pk=None):
+		'''Unblocks a card blocked after too many wrong PINs or card details'''
+		card = self.get_object()
+		card.unblock()
+		return Response(self.get_serializer(card).data)
+
+class CardAuthorizationView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+	'''Called by card terminals, which authenticate with their key instead of a user token'''
+	serializer_class = serializers.CardAuthorizationSerializer
+	authentication_classes = ()
+	permission_classes = (HasTerminalKey,)
+	lookup_value_regex = '[0-9]+'
+
+	@action(detail=True, methods=['post'])
+	def capture(self, request, pk=None):
+		'''Settles the authorization, for the given amount (at most the authorized one) or the whole hold'''
+		data = serializers.HoldCaptureSerializer(data=request.data)
+		data.is_valid(raise_exception=True)
+		return Response(self.get_serializer(holds.capture(int(pk), terminal_id(request), data.validated_data.get('amount'))).data)
+
+	@action(detail=True, methods=['post'])
+	def release(self, request, pk=None):
+		'''Cancels the authorization, giving the held funds back'''
+		return Response(self.get_serializer(holds.release(int(pk), terminal_id(request))).data)
@@ -0,0 +1,8 @@
+'''Helpers for the process pools of the management commands'''
+import django
+from django.db import connections
+
+def init_worker():
+	'''Process pool initializer, workers need their own database connections'''
+	django.setup()
+	connections.close_all()
@@ -2,6 +2,7 @@
 ASGI config for upbank project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The async views (api/async/...) only avoid holding a thread per request when served from here.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -0,0 +1,71 @@
+'''
+Async login and signup, meant to be served by the ASGI app (upbank/asgi.py).
+
+While the password is hashed on the hashing pool the event loop keeps serving other requests, so a signup or login
+spike doesn't take a worker thread per request. Responses match the synchronous endpoints.
+'''
+import json
+
+from asgiref.sync import sync_to_async
+from djangorestframework_camel_case.util import camelize, underscoreize
+from knox.models import AuthToken
+from knox.settings import knox_settings
+from rest_framework import exceptions
+from rest_framework.serializers import DateTimeField
+
+from django.contrib.auth.signals import user_logged_in
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+
+from banking.serializers import AccountSerializer
+from upbank import hashing
+
+def _api_view(view):
+	'''Only POST with a JSON body, turns APIExceptions into error responses like DRF would'''
+	async def wrapper(request):
+		if request.method != 'POST':
+			return HttpResponseNotAllowed(['POST'])
+		try:
+			data = json.loads(request.body or b'{}')
+		except ValueError:
+			return JsonResponse({'detail' : 'JSON parse error'}, status=400)
+		if not isinstance(data, dict):
+			return JsonResponse({'nonFieldErrors' : ['Invalid data. Expected a dictionary.']}, status=400)
+		try:
+			return await view(request, underscoreize(data))
+		except exceptions.APIException as e:
+			detail = e.detail if isinstance(e.detail, (list, dict)) else {'detail' : e.detail}
+			return JsonResponse(camelize(detail), status=e.status_code, safe=False)
+	wrapper.csrf_exempt = True # Token authenticated like the DRF views, csrf_exempt() itself can't wrap coroutines yet
+	return wrapper
+
+@_api_view
+async def login(request, data):
+	username, password = data.get('username'), data.get('password')
+	if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+		raise exceptions.ValidationError({'non_field_errors' : ['Must include "username" and "password".']}, code='authorization')
+
+	user = await hashing.aauthenticate(username, password)
+	if user is None:
+		raise exceptions.ValidationError({'non_field_errors' : ['Unable to log in with provided credentials.']}, code='authorization')
+
+	if knox_settings.TOKEN_LIMIT_PER_USER is not None:
+		if await user.auth_token_set.filter(expiry__gt=timezone.now()).acount() >= knox_settings.TOKEN_LIMIT_PER_USER:
+			return JsonResponse({'error' : 'Maximum amount of tokens allowed per user exceeded.'}, status=403)
+	instance, token = await sync_to_async(AuthToken.objects.create)(user, knox_settings.TOKEN_TTL)
+	await sync_to_async(user_logged_in.send)(sender=user.__class__, request=request, user=user)
+	return JsonResponse({
+		'expiry' : DateTimeField(format=knox_settings.EXPIRY_DATETIME_FORMAT).to_representation(instance.expiry),
+		'token' : token,
+	})
+
+@_api_view
+async def signup(request, data):
+	serializer = AccountSerializer(data=data, context={'request' : request})
+	await sync_to_async(serializer.is_valid)(raise_exception=True)
+	password_hash = await hashing.amake_password(serializer.validated_data['password'])
+
+	def save():
+		serializer.save(password_hash=password_hash)
+		return serializer.data
+	return JsonResponse(camelize(await sync_to_async(save)()), status=201)
@@ -0,0 +1,108 @@
+'''
+Password hashing off the request thread.
+
+Argon2 holds a CPU for tens of milliseconds per hash, so with settings.PASSWORD_HASHING_WORKERS > 0 hashes are computed
+on a bounded process pool and the request only waits for the result. At most PASSWORD_HASHING_QUEUE hashes per worker
+can be pending, past that requests are turned away with a 503 instead of piling up behind the pool.
+'''
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions, status
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import hashers
+
+class HashingBusy(exceptions.APIException):
+	status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+	default_detail = 'errors.server_busy'
+	default_code = 'server_busy'
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+
+def _executor():
+	global _pool, _slots
+	with _lock:
+		if _pool is None:
+			# Spawned rather than forked, forking a process that already runs threads (or an event loop) isn't safe
+			_pool = ProcessPoolExecutor(
+				max_workers=settings.PASSWORD_HASHING_WORKERS,
+				mp_context=multiprocessing.get_context('spawn'),
+				initializer=django.setup
+			)
+			_slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_WORKERS * settings.PASSWORD_HASHING_QUEUE)
+		return _pool
+
+def submit(function, *args, timeout=None):
+	'''Run function(*args) on the pool, waiting up to timeout seconds (default PASSWORD_HASHING_TIMEOUT) for a free slot'''
+	pool = _executor()
+	if not _slots.acquire(timeout=settings.PASSWORD_HASHING_TIMEOUT if timeout is None else timeout):
+		raise HashingBusy()
+	try:
+		future = pool.submit(function, *args)
+	except BaseException:
+		_slots.release()
+		raise
+	future.add_done_callback(lambda _: _slots.release())
+	return future
+
+def make_password(password):
+	if not settings.PASSWORD_HASHING_WORKERS:
+		return hashers.make_password(password)
+	return submit(hashers.make_password, password).result()
+
+def check_password(password, encoded):
+	if not settings.PASSWORD_HASHING_WORKERS:
+		return hashers.check_password(password, encoded)
+	return submit(hashers.check_password, password, encoded).result()
+
+async def amake_password(password):
+	if not settings.PASSWORD_HASHING_WORKERS:
+		return await sync_to_async(hashers.make_password)(password)
+	return await asyncio.wrap_future(submit(hashers.make_password, password, timeout=0)) # Don't block the event loop waiting for a slot
+
+async def acheck_password(password, encoded):
+	if not settings.PASSWORD_HASHING_WORKERS:
+		return await sync_to_async(hashers.check_password)(password, encoded)
+	return await asyncio.wrap_future(submit(hashers.check_password, password, encoded, timeout=0))
+
+def _must_update(encoded):
+	'''Whether the stored hash uses an outdated hasher or parameters, like ModelBackend checks on every login'''
+	try:
+		return hashers.identify_hasher(encoded).algorithm != hashers.get_hasher().algorithm or hashers.get_hasher().must_update(encoded)
+	except ValueError:
+		return False
+
+def authenticate(username, password):
+	'''Same checks as ModelBackend.authenticate, but hashing on the pool, returns the active user or None'''
+	User = apps.get_model(settings.AUTH_USER_MODEL)
+	user = User._default_manager.filter(**{User.USERNAME_FIELD : username}).first()
+	if user is None:
+		make_password(password) # Take as long as a wrong password would, so usernames can't be probed by timing
+		return None
+	if not user.is_active or not user.has_usable_password() or not check_password(password, user.password):
+		return None
+	if _must_update(user.password):
+		user.password = make_password(password)
+		user.save(update_fields=['password'])
+	return user
+
+async def aauthenticate(username, password):
+	User = apps.get_model(settings.AUTH_USER_MODEL)
+	user = await User._default_manager.filter(**{User.USERNAME_FIELD : username}).afirst()
+	if user is None:
+		await amake_password(password)
+		return None
+	if not user.is_active or not user.has_usable_password() or not await acheck_password(password, user.password):
+		return None
+	if _must_update(user.password):
+		user.password = await amake_password(password)
+		await sync_to_async(user.save)(update_fields=['password'])
+	return user
@@ -0,0 +1,77 @@
+'''
+Knox token authentication with the validated tokens cached by digest.
+
+A cache hit skips the token lookup, knox's sweep of the user's expired tokens and the expiry write: the request costs
+a single query loading the user (and their account). Expiry refreshes are coalesced to one write per token every
+TOKEN_REFRESH_INTERVAL seconds, and deleted tokens (logout, expiry) are evicted through the post_delete signal.
+'''
+import binascii
+import datetime
+
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+from rest_framework import exceptions
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+def _cache():
+	return caches[settings.TOKEN_CACHE]
+
+def _key(digest):
+	return f'token:{digest}'
+
+class CachedTokenAuthentication(TokenAuthentication):
+	def authenticate_credentials(self, token):
+		try:
+			digest = hash_token(token.decode('utf-8'))
+		except (TypeError, UnicodeDecodeError, binascii.Error):
+			raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+		entry = _cache().get(_key(digest))
+		if entry is None or (entry['expiry'] is not None and entry['expiry'] < timezone.now()):
+			# Unknown or expired as far as we know, let knox check (and clean up) the token table
+			user, auth_token = super().authenticate_credentials(token)
+			self._remember(auth_token)
+			return user, auth_token
+
+		User = apps.get_model(settings.AUTH_USER_MODEL)
+		try:
+			user = User.objects.select_related('account').get(pk=entry['user_id'])
+		except User.DoesNotExist:
+			raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+		auth_token = AuthToken(pk=entry['id'], digest=digest, token_key=entry['token_key'], user=user, expiry=entry['expiry'])
+		if knox_settings.AUTO_REFRESH and auth_token.expiry:
+			self.renew_token(auth_token)
+		return self.validate_user(auth_token)
+
+	def renew_token(self, auth_token):
+		'''Writes the new expiry at most once per TOKEN_REFRESH_INTERVAL per token, across every process sharing the cache'''
+		if not _cache().add(f'token-refresh:{auth_token.digest}', True, timeout=settings.TOKEN_REFRESH_INTERVAL):
+			return
+		auth_token.expiry = timezone.now() + knox_settings.TOKEN_TTL
+		AuthToken.objects.filter(pk=auth_token.pk).update(expiry=auth_token.expiry)
+		self._remember(auth_token)
+
+	def _remember(self, auth_token):
+		timeout = settings.TOKEN_CACHE_TIMEOUT
+		if auth_token.expiry is not None:
+			timeout = min(timeout, (auth_token.expiry - timezone.now()) / datetime.timedelta(seconds=1))
+		if timeout > 0:
+			_cache().set(_key(auth_token.digest), {
+				'id' : auth_token.pk,
+				'token_key' : auth_token.token_key,
+				'user_id' : auth_token.user_id,
+				'expiry' : auth_token.expiry,
+			}, timeout=timeout)
+
+@receiver(post_delete, sender=AuthToken)
+def _evict(sender, instance, **kwargs):
+	_cache().delete(_key(instance.digest))
@@ -1,13 +1,26 @@
 from django.contrib.auth import login
-from rest_framework import permissions
+from django.utils.translation import gettext_lazy as _
+from rest_framework import permissions, serializers
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 from knox.views import LoginView as KnoxLoginView
+
+from upbank import hashing
+
+class LoginSerializer(AuthTokenSerializer):
+	'''AuthTokenSerializer checking the password on the hashing pool instead of the request thread'''
+	def validate(self, attrs):
+		user = hashing.authenticate(attrs.get('username'), attrs.get('password'))
+		if user is None:
+			raise serializers.ValidationError(_('Unable to log in with provided credentials.'), code='authorization')
+		attrs['user'] = user
+		return attrs
+
 class LoginView(KnoxLoginView):
 	permission_classes = (permissions.AllowAny,)
 
 	def post(self, request, format=None):
-		serializer = AuthTokenSerializer(data=request.data)
+		serializer = LoginSerializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
 		user = serializer.validated_data['user']
 		login(request, user)
-		return super(LoginView, self).post(request, format=None)
\ No newline at end of file
+		return super(LoginView, self).post(request, format=None)
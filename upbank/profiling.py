@@ -0,0 +1,131 @@
+'''
+Per-view query count and latency instrumentation, enabled with settings.PROFILING.
+
+Every response gets a Server-Timing header, and the timings are aggregated per view and method
+in an in-process histogram served by ProfileView (each worker process keeps its own). The header of a streaming
+response only covers the time until streaming starts, the histogram records it once the whole body was sent.
+'''
+import bisect
+import threading
+from contextlib import ExitStack
+from time import perf_counter
+
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Upper bounds of the latency buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+class Histogram:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._views = {}
+
+	def record(self, key, total, db_time, queries):
+		with self._lock:
+			stats = self._views.setdefault(key, {'count' : 0, 'total_ms' : 0.0, 'db_ms' : 0.0, 'queries' : 0, 'max_queries' : 0, 'buckets' : [0] * len(BUCKETS)})
+			stats['count'] += 1
+			stats['total_ms'] += total
+			stats['db_ms'] += db_time
+			stats['queries'] += queries
+			stats['max_queries'] = max(stats['max_queries'], queries)
+			stats['buckets'][bisect.bisect_left(BUCKETS, total)] += 1
+
+	def reset(self):
+		with self._lock:
+			self._views.clear()
+
+	@staticmethod
+	def _percentile(buckets, count, fraction):
+		'''Upper bound of the bucket holding the given fraction of the requests'''
+		seen = 0
+		for bound, bucket in zip(BUCKETS, buckets):
+			seen += bucket
+			if seen >= count * fraction:
+				return bound
+		return BUCKETS[-1]
+
+	def snapshot(self):
+		with self._lock:
+			views = {key : {**stats, 'buckets' : list(stats['buckets'])} for key, stats in self._views.items()}
+		return {
+			key : {
+				'count' : stats['count'],
+				'avg_ms' : stats['total_ms'] / stats['count'],
+				'avg_db_ms' : stats['db_ms'] / stats['count'],
+				'avg_queries' : stats['queries'] / stats['count'],
+				'max_queries' : stats['max_queries'],
+				'p50_ms' : self._percentile(stats['buckets'], stats['count'], 0.5),
+				'p99_ms' : self._percentile(stats['buckets'], stats['count'], 0.99),
+				'buckets' : {str(bound) : bucket for bound, bucket in zip(BUCKETS, stats['buckets'])},
+			}
+			for key, stats in sorted(views.items())
+		}
+
+histogram = Histogram()
+
+class _QueryTimer:
+	'''Database execute wrapper counting the queries and the time spent running them'''
+	def __init__(self):
+		self.queries = 0
+		self.db_time = 0.0
+
+	def __call__(self, execute, sql, params, many, context):
+		start = perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.queries += 1
+			self.db_time += perf_counter() - start
+
+	def wrap_connections(self):
+		stack = ExitStack()
+		for connection in connections.all():
+			stack.enter_context(connection.execute_wrapper(self))
+		return stack
+
+class ProfilingMiddleware:
+	def __init__(self, get_response):
+		if not settings.PROFILING:
+			raise MiddlewareNotUsed()
+		self.get_response = get_response
+
+	def __call__(self, request):
+		timer = _QueryTimer()
+		start = perf_counter()
+		with timer.wrap_connections():
+			response = self.get_response(request)
+		total = (perf_counter() - start) * 1000
+
+		view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+		key = f'{request.method} {view}'
+		if response.streaming:
+			response.streaming_content = self._stream(response.streaming_content, timer, start, key)
+		else:
+			histogram.record(key, total, timer.db_time * 1000, timer.queries)
+		response['Server-Timing'] = f'db;dur={timer.db_time * 1000:.1f};desc="{timer.queries} queries", total;dur={total:.1f}'
+		return response
+
+	@staticmethod
+	def _stream(content, timer, start, key):
+		'''Keeps counting while the body is streamed (the queries of a streamed export run here), records it at the end'''
+		try:
+			with timer.wrap_connections():
+				yield from content
+		finally:
+			histogram.record(key, (perf_counter() - start) * 1000, timer.db_time * 1000, timer.queries)
+
+class ProfileView(APIView):
+	'''Dumps the histogram of this worker process, ?reset=true clears it afterwards'''
+	permission_classes = (permissions.IsAdminUser,)
+
+	def get(self, request, format=None):
+		snapshot = histogram.snapshot()
+		if request.query_params.get('reset') == 'true':
+			histogram.reset()
+		return Response(snapshot)
@@ -69,6 +69,11 @@ if DEBUG:
 	MIDDLEWARE.append('django.middleware.csrf.CsrfViewMiddleware')
 	MIDDLEWARE.append('django.contrib.messages.middleware.MessageMiddleware')
 
+# Per-view query count and latency (Server-Timing header and api/debug/profile), see upbank.profiling
+PROFILING = os.environ.get('DJANGO_PROFILING', 'False') == 'True'
+if PROFILING:
+	MIDDLEWARE.insert(0, 'upbank.profiling.ProfilingMiddleware')
+
 ROOT_URLCONF = 'upbank.urls'
 
 TEMPLATES = [
@@ -125,6 +130,44 @@ if DEBUG:
 			'NAME': ':memory:',
 		}
 
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+	},
+	# Responses of payment requests sent with an Idempotency-Key header, see banking.idempotency
+	# Point it at a shared backend (e.g. Redis) when running several processes
+	'idempotency': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'idempotency',
+		'TIMEOUT': 60 * 60 * 24,
+		'OPTIONS': {
+			'MAX_ENTRIES': 100000,
+		},
+	},
+	# Serialized telco providers and account profiles, see banking.response_cache. Evicted on writes by the
+	# processes sharing this cache, the timeout bounds how stale the others can get unless it points at a shared backend
+	'responses': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'responses',
+		'TIMEOUT': 60 * 5,
+		'OPTIONS': {
+			'MAX_ENTRIES': 50000,
+		},
+	},
+	# Validated auth tokens, see upbank.knox_auth. Deleted tokens are only evicted from the processes sharing
+	# this cache, others keep accepting them for up to TOKEN_CACHE_TIMEOUT unless it points at a shared backend
+	'tokens': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+		'LOCATION': 'tokens',
+		'OPTIONS': {
+			'MAX_ENTRIES': 50000,
+		},
+	},
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -185,7 +228,7 @@ REST_KNOX = {
 }
 
 REST_FRAMEWORK = {
-	'DEFAULT_AUTHENTICATION_CLASSES': ('knox.auth.TokenAuthentication',),
+	'DEFAULT_AUTHENTICATION_CLASSES': ('upbank.knox_auth.CachedTokenAuthentication',),
 	'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
 	'DEFAULT_RENDERER_CLASSES': (
 		'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
@@ -201,4 +244,48 @@ REST_FRAMEWORK = {
 
 DEFAULT_BALANCE = 10000
 MAX_PIN = 9999
-MAX_CVV = 999
\ No newline at end of file
+MAX_CVV = 999
+
+# Optional {full_name : id} mapping of the system accounts (__UPBANK__, __BANK_TRANSFER__, ...)
+# Accounts missing from it are looked up once per process by banking.system_accounts
+SYSTEM_ACCOUNTS = {}
+
+# System accounts whose incoming payments are spread over ACCOUNT_SHARDS balance rows
+# Run `manage.py fold_account_shards` periodically to move the shard balances back into the account
+SHARDED_ACCOUNTS = ['__BANK_TRANSFER__', '__SERVICE_PAYMENT__', '__GOVERNMENT_PAYMENT__']
+ACCOUNT_SHARDS = 16
+
+# Seconds an Idempotency-Key stays claimed by a request still running, so a key whose request died can be retried
+# Completed responses are kept for the idempotency cache TIMEOUT
+IDEMPOTENCY_LEASE = 60
+
+# Maximum number of transfers in a single batch-transfers request
+MAX_BATCH_TRANSFERS = 500
+
+# Ledger mode: transfers append ledger entries instead of updating balances in place
+# Requires `manage.py materialize_ledger --loop` to run in the background, see banking.ledger
+LEDGER_MODE = os.environ.get('DJANGO_LEDGER_MODE', 'False') == 'True'
+
+# Password hashes are computed on a pool of this many processes instead of the request thread, 0 hashes inline
+# At most PASSWORD_HASHING_QUEUE hashes per process can wait, requests wait PASSWORD_HASHING_TIMEOUT seconds for a slot before getting a 503
+PASSWORD_HASHING_WORKERS = int(os.environ.get('DJANGO_PASSWORD_HASHING_WORKERS', '0'))
+PASSWORD_HASHING_QUEUE = 8
+PASSWORD_HASHING_TIMEOUT = 2
+
+# Cache alias and lifetime (seconds) of validated auth tokens, and how often a token's expiry is written back at most
+TOKEN_CACHE = 'tokens'
+TOKEN_CACHE_TIMEOUT = 60
+TOKEN_REFRESH_INTERVAL = 60
+
+# Keys card terminals authenticate with (Terminal-Key header) on card-authorizations/, comma separated
+CARD_TERMINAL_KEYS = [key for key in os.environ.get('DJANGO_CARD_TERMINAL_KEYS', '').split(',') if key]
+# Cards kept in the in-process authorization index, and how many seconds a card is trusted before being reloaded
+CARD_INDEX_SIZE = 100000
+CARD_INDEX_TTL = 30
+# Largest NFC payment (in cents) authorized without the PIN
+CARD_CONTACTLESS_LIMIT = 5000
+# Wrong PINs or card details in a row after which a card is blocked
+CARD_MAX_FAILED_ATTEMPTS = 3
+
+# How long a hold reserves funds when it is neither captured nor released, run `manage.py expire_holds --loop` to sweep expired ones
+HOLD_TTL = timedelta(days=7)
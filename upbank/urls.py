@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
 from knox import views as knox_views
 
+from upbank import async_auth
 from upbank.knox_login import LoginView
+from upbank.profiling import ProfileView
 
 urlpatterns = [
 	path('admin/', admin.site.urls),
@@ -11,4 +14,10 @@ urlpatterns = [
 	path('api/auth/login', LoginView.as_view(), name='knox_login'),
 	path('api/auth/logout', knox_views.LogoutView.as_view(), name='knox_logout'),
 	path('api/auth/logoutall', knox_views.LogoutAllView.as_view(), name='knox_logoutall'),
+	# Async variants, served without holding a thread while the password is hashed when running under ASGI
+	path('api/async/auth/login', async_auth.login, name='async_login'),
+	path('api/async/auth/signup', async_auth.signup, name='async_signup'),
 ]
+
+if settings.PROFILING:
+	urlpatterns.append(path('api/debug/profile', ProfileView.as_view(), name='profile'))